@@ -0,0 +1,114 @@
+import os
+import hashlib
+import threading
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+# Raíz común de las cachés en disco (configurable por entorno)
+CACHE_ROOT = Path(os.environ.get("SUITE_CACHE_DIR", Path.home() / ".cache" / "suite_multimedia"))
+
+
+def make_key(*parts) -> str:
+    """Clave de contenido: SHA-256 sobre las partes (bytes o cualquier valor convertible a str)."""
+    h = hashlib.sha256()
+    for p in parts:
+        data = p if isinstance(p, (bytes, bytearray, memoryview)) else str(p).encode("utf-8")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class DiskLRUCache:
+    """
+    Caché clave → bytes en disco con tamaño máximo y expulsión LRU.
+    El orden de uso se lleva en el mtime de cada fichero, así sobrevive a reinicios.
+    El total de bytes se lleva en memoria (un recorrido al arrancar); el directorio solo se vuelve a
+    recorrer cuando ese total supera max_bytes, y entonces se corrige con lo que haya en disco y se
+    expulsa hasta el 90 %: con la caché llena no hay un recorrido por cada escritura.
+    """
+
+    LOW_WATER = 0.9
+
+    def __init__(self, directory, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total = sum(size for _, size, _ in self._scan())
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            previous = path.stat().st_size
+        except OSError:
+            previous = 0
+        # Escritura atómica: otra sesión nunca ve un fichero a medias
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(data) - previous
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def _scan(self):
+        entries = []
+        for p in self.directory.glob("*/*"):
+            if p.suffix == ".tmp":
+                continue
+            try:
+                st_ = p.stat()
+            except OSError:
+                continue
+            entries.append((st_.st_mtime, st_.st_size, p))
+        return entries
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            self._total = total
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            target = int(self.max_bytes * self.LOW_WATER)
+            for _, size, p in entries:
+                if total <= target:
+                    break
+                try:
+                    p.unlink()
+                    total -= size
+                except OSError:
+                    pass
+            self._total = total
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats_text(self) -> str:
+        total = self.hits + self.misses
+        return f"{self.hits}/{total} aciertos ({self.hit_rate:.0%})"
@@ -1,12 +1,25 @@
 import streamlit as st
 import io
+import os
 import re
-from typing import List, Tuple
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
 
 import numpy as np
 from PyPDF2 import PdfReader
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from modules.cache_disco import CACHE_ROOT, make_key
 
 # Opcional: embeddings si está disponible (fallback automático a TF-IDF)
 _EMB_OK = False
@@ -16,20 +29,89 @@ try:
 except Exception:
     _EMB_OK = False
 
+# Opcional: OCR de páginas escaneadas (Tesseract vía el módulo de OCR)
+_OCR_OK = False
+try:
+    from modules.ocr import OCR_LANG, image_to_text, init_ocr_worker, render_pdf_pages
+    _OCR_OK = True
+except Exception:
+    _OCR_OK = False
+
+# Opcional: búsqueda aproximada de vecinos (ANN) con FAISS
+_FAISS_OK = False
+try:
+    import faiss
+    _FAISS_OK = True
+except Exception:
+    _FAISS_OK = False
+
 
 # ---------------------------
-# Utilidades de extracción
+# Extracción paralela por páginas
 # ---------------------------
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    reader = PdfReader(io.BytesIO(file_bytes))
-    texts = []
-    for page in reader.pages:
+MIN_PAGE_CHARS = 20  # menos texto que esto: la página se trata como escaneada
+PAGES_PER_TASK = 4
+
+_worker_pdf = None
+
+
+def _init_extract_worker(data: bytes, ocr: bool = True):
+    # El PDF se envía una vez por proceso, no en cada tarea
+    global _worker_pdf
+    _worker_pdf = data
+    # Tesseract (y el traineddata) solo se cargan si el usuario pidió OCR
+    if ocr and _OCR_OK:
+        init_ocr_worker(OCR_LANG, "tesserocr")
+
+
+def extract_page_range(start: int, stop: int, ocr: bool = True, data: bytes = None) -> List[dict]:
+    """
+    Tarea de worker: texto de las páginas [start, stop) con su tiempo. Las páginas sin capa de texto
+    se rasterizan y pasan por OCR. Devuelve registros serializables, uno por página.
+    """
+    data = data if data is not None else _worker_pdf
+    reader = PdfReader(io.BytesIO(data))
+    records = []
+    for i in range(start, stop):
+        t0 = time.time()
         try:
-            txt = page.extract_text() or ""
-        except Exception:
-            txt = ""
-        texts.append(txt)
-    return "\n".join(texts)
+            text, error = reader.pages[i].extract_text() or "", None
+        except Exception as e:
+            text, error = "", str(e)
+        records.append({"pagina": i + 1, "texto": text, "metodo": "texto", "segundos": time.time() - t0,
+                        "error": error})
+
+    scanned = [r for r in records if len(r["texto"].strip()) < MIN_PAGE_CHARS]
+    if ocr and _OCR_OK and scanned:
+        by_index = {r["pagina"] - 1: r for r in scanned}
+        t0 = time.time()
+        try:
+            for i, image in render_pdf_pages(data, list(by_index)):
+                rec = by_index[i]
+                if image is not None:
+                    rec["texto"], rec["metodo"] = image_to_text(image, OCR_LANG, "tesserocr"), "ocr"
+                rec["segundos"] += time.time() - t0
+                t0 = time.time()
+        except Exception as e:
+            for rec in scanned:
+                rec["error"] = rec["error"] or f"OCR: {e}"
+    for rec in records:
+        rec["segundos"] = round(rec["segundos"], 3)
+    return records
+
+
+def iter_extracted_pages(data: bytes, workers: int = 4, ocr: bool = True, pages_per_task: int = PAGES_PER_TASK):
+    """Extrae en un pool de procesos por tramos de páginas. Genera los registros según terminan (no en orden)."""
+    n_pages = len(PdfReader(io.BytesIO(data)).pages)
+    if workers <= 1:
+        for start in range(0, n_pages, pages_per_task):
+            yield from extract_page_range(start, min(start + pages_per_task, n_pages), ocr, data)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker, initargs=(data, ocr)) as ex:
+        futures = [ex.submit(extract_page_range, start, min(start + pages_per_task, n_pages), ocr)
+                   for start in range(0, n_pages, pages_per_task)]
+        for fut in as_completed(futures):
+            yield from fut.result()
 
 
 # ---------------------------
@@ -74,10 +156,52 @@ def make_chunks(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[s
     return chunks
 
 
+def stream_page_chunks(data: bytes, chunk_size: int = 1200, overlap: int = 200, workers: int = 4,
+                       ocr: bool = True):
+    """Genera (registro de página, [(página, chunk), ...]) en cuanto termina cada página."""
+    for rec in iter_extracted_pages(data, workers, ocr):
+        yield rec, [(rec["pagina"], c) for c in make_chunks(rec["texto"], chunk_size, overlap)]
+
+
+def extract_page_chunks(data: bytes, chunk_size: int = 1200, overlap: int = 200, workers: int = 4,
+                        ocr: bool = True) -> List[Tuple[int, str]]:
+    by_page = {rec["pagina"]: rows for rec, rows in stream_page_chunks(data, chunk_size, overlap, workers, ocr)}
+    return [row for page in sorted(by_page) for row in by_page[page]]
+
+
 # ---------------------------
 # Indexadores
 # ---------------------------
+# Stoplist simple ES+EN sin NLTK para evitar descargas
+STOPLIST = [
+    "de","la","que","el","en","y","a","los","del","se","las","por","un","para","con","no","una",
+    "su","al","lo","como","más","pero","sus","le","ya","o","este","sí","porque","esta","entre",
+    "cuando","muy","sin","sobre","también","me","hasta","hay","donde","quien","desde","todo",
+    "nos","durante","todos","uno","les","ni","contra","otros","ese","eso","ante","ellos","e",
+    "esto","mí","antes","algunos","qué","unos","yo","otro","otras","otra","él","tanto","esa","estos",
+    "mucho","quienes","nada","muchos","cual","poco","ella","estar","estas","algunas","algo","nosotros",
+    "mi","mis","tú","te","ti","tu","tus","ellas","nosotras","vosotros","vosotras","os","mío","mía",
+    "míos","mías","tuyo","tuya","tuyos","tuyas","suyo","suya","suyos","suyas","nuestro","nuestra",
+    "nuestros","nuestras","vuestro","vuestra","vuestros","vuestras","esos","esas","estoy","estás",
+    "está","estamos","estáis","están","esté","estés","estemos","estéis","estén","estaré","estarás",
+    "estará","estaremos","estaréis","estarán","he","has","ha","hemos","habéis","han","haya","hayas",
+    "ing","the","and","to","of","in","that","is","for","on","it","with","as","are","was","at","by",
+    "be","this","from","or","an","which","but","not","have","has","had","were","their","they","you",
+    "we","his","her","its","can","all","one","more","about","there","been","if","when","who","will",
+    "would","what","so","no","up","out","do","into","than","your","them","could","my","over","some"
+]
+DEFAULT_EMB_MODEL = "all-MiniLM-L6-v2"
+
+
+@st.cache_resource(show_spinner=False)
+def load_sentence_model(model_name: str = DEFAULT_EMB_MODEL):
+    """Modelo de embeddings compartido: cargarlo es lo más lento al reabrir un índice guardado."""
+    return SentenceTransformer(model_name)
+
+
 class TFIDFIndexer:
+    kind = "tfidf"
+
     def __init__(self, stoplist: List[str] = None):
         self.stoplist = stoplist
         self.vectorizer = TfidfVectorizer(
@@ -96,25 +220,574 @@ class TFIDFIndexer:
         order = np.argsort(sims)[::-1][:top_k]
         return [(int(i), float(sims[i])) for i in order]
 
+    def save(self, directory: Path):
+        # Vocabulario e idf en formatos neutros: un pickle de sklearn deja de cargar al actualizarlo
+        vocabulary = {t: int(i) for t, i in self.vectorizer.vocabulary_.items()}
+        with open(directory / "vocabulario.json", "w", encoding="utf-8") as f:
+            json.dump({"stoplist": self.stoplist, "vocabulario": vocabulary}, f, ensure_ascii=False)
+        np.save(directory / "idf.npy", self.vectorizer.idf_)
+        sparse.save_npz(directory / "tfidf.npz", self._X.tocsr(), compressed=False)
+
+    @classmethod
+    def load(cls, directory: Path, chunks: List[str]) -> "TFIDFIndexer":
+        with open(directory / "vocabulario.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(stoplist=meta["stoplist"])
+        # Vocabulario fijo + idf guardado: transform() queda igual que tras el fit original
+        index.vectorizer.set_params(vocabulary=meta["vocabulario"])
+        idf = np.load(directory / "idf.npy")
+        X = sparse.load_npz(directory / "tfidf.npz")
+        if idf.shape != (len(meta["vocabulario"]),) or X.shape != (len(chunks), len(idf)):
+            raise ValueError("Índice TF-IDF inconsistente con sus chunks")
+        index.vectorizer.idf_ = idf
+        index._X = X
+        index._chunks = chunks
+        return index
+
+
+ANN_VARIANTS = {
+    "Exacta (NumPy)": None,
+    "FAISS Flat": "flat",
+    "FAISS IVF": "ivf",
+    "FAISS HNSW": "hnsw",
+}
+
+
+def build_ann_index(E: np.ndarray, variant: str, hnsw_m: int = 32):
+    """Índice FAISS de producto interno (coseno con embeddings normalizados) sobre las filas de E."""
+    if not _FAISS_OK:
+        raise RuntimeError("faiss no disponible")
+    E = np.ascontiguousarray(E, dtype=np.float32)
+    n, d = E.shape
+    if variant == "flat":
+        spec = "Flat"
+    elif variant == "ivf":
+        # ~4·√n listas, con al menos 39 puntos de entrenamiento por centroide (mínimo que pide FAISS)
+        spec = f"IVF{max(1, min(int(4 * np.sqrt(n)), n // 39))},Flat"
+    elif variant == "hnsw":
+        spec = f"HNSW{hnsw_m}"
+    else:
+        raise ValueError(f"Variante ANN desconocida: {variant}")
+    index = faiss.index_factory(d, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(E)
+    index.add(E)
+    return index
+
+
+def set_ann_params(index, nprobe: int = 8, ef_search: int = 64):
+    """Parámetros de búsqueda: nprobe (IVF) y efSearch (HNSW). Más alto = más recall y más latencia."""
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
 
 class EmbeddingIndexer:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, model_name: str = DEFAULT_EMB_MODEL, ann: Optional[str] = None, nprobe: int = 8,
+                 ef_search: int = 64):
         if not _EMB_OK:
             raise RuntimeError("sentence-transformers no disponible")
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        self.model = load_sentence_model(model_name)
+        self.ann = ann
+        self.nprobe = nprobe
+        self.ef_search = ef_search
         self._E = None
+        self._ann_index = None
         self._chunks = None
 
-    def fit(self, chunks: List[str]):
-        self._chunks = chunks
-        self._E = self.model.encode(chunks, normalize_embeddings=True, show_progress_bar=False)
+    def _build_ann(self):
+        self.attach_ann(self.ann, build_ann_index(self._E, self.ann) if self.ann else None)
 
-    def query(self, q: str, top_k: int = 3) -> List[Tuple[int, float]]:
-        q_emb = self.model.encode([q], normalize_embeddings=True, show_progress_bar=False)[0]
+    def attach_ann(self, ann: Optional[str], ann_index):
+        """Usa un índice FAISS ya construido (p. ej. leído del almacén) para la variante ann."""
+        self.ann, self._ann_index = ann, ann_index
+        self.set_search_params(self.nprobe, self.ef_search)
+
+    def set_search_params(self, nprobe: int = 8, ef_search: int = 64):
+        """Parámetros de búsqueda ANN: se aplican sobre el índice existente, sin reconstruirlo."""
+        self.nprobe, self.ef_search = nprobe, ef_search
+        if self._ann_index is not None:
+            set_ann_params(self._ann_index, nprobe, ef_search)
+
+    @property
+    def kind(self) -> str:
+        return f"emb:{self.model_name}"
+
+    def fit(self, chunks: List[str], embeddings: Optional[np.ndarray] = None):
+        """embeddings: vectores ya calculados (p. ej. según se extraían las páginas) en el orden de chunks."""
+        self._chunks = chunks
+        if embeddings is None:
+            embeddings = self.model.encode(chunks, normalize_embeddings=True, show_progress_bar=False)
+        self._E = np.asarray(embeddings, dtype=np.float32)
+        self._build_ann()
+
+    def search(self, q_emb: np.ndarray, top_k: int = 3) -> List[Tuple[int, float]]:
+        if self._ann_index is not None:
+            D, I = self._ann_index.search(np.asarray(q_emb, dtype=np.float32)[None, :], top_k)
+            return [(int(i), float(d)) for i, d in zip(I[0], D[0]) if i >= 0]
         sims = (self._E @ q_emb)
         order = np.argsort(sims)[::-1][:top_k]
         return [(int(i), float(sims[i])) for i in order]
 
+    def query(self, q: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        q_emb = self.model.encode([q], normalize_embeddings=True, show_progress_bar=False)[0]
+        return self.search(q_emb, top_k)
+
+    def save(self, directory: Path):
+        np.save(directory / "embeddings.npy", np.asarray(self._E, dtype=np.float32))
+
+    @classmethod
+    def load(cls, directory: Path, chunks: List[str], model_name: str = DEFAULT_EMB_MODEL) -> "EmbeddingIndexer":
+        index = cls(model_name)
+        # Mapeado en memoria: la carga no lee la matriz; las páginas se traen al consultar
+        index._E = np.load(directory / "embeddings.npy", mmap_mode="r")
+        if index._E.shape[0] != len(chunks):
+            raise ValueError("Embeddings inconsistentes con sus chunks")
+        index._chunks = chunks
+        return index
+
+
+def benchmark_ann(E: np.ndarray, k: int = 5, n_queries: int = 200, nprobes=(1, 4, 16, 64),
+                  ef_searches=(16, 64, 256), seed: int = 0):
+    """
+    recall@k y latencia por consulta de cada variante FAISS frente a la búsqueda exacta.
+    Las consultas son embeddings de chunks tomados al azar (no hay un conjunto de preguntas real).
+    """
+    E = np.ascontiguousarray(E, dtype=np.float32)
+    k = min(k, len(E))
+    rng = np.random.default_rng(seed)
+    Q = E[rng.choice(len(E), size=min(n_queries, len(E)), replace=False)]
+
+    t0 = time.time()
+    sims = Q @ E.T
+    truth = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    exact_ms = (time.time() - t0) * 1000 / len(Q)
+    rows = [{"variante": "Exacta (NumPy)", "parámetro": "-", "construcción_s": 0.0,
+             "latencia_ms": round(exact_ms, 3), f"recall@{k}": 1.0}]
+
+    for variant, label, values in (("flat", "-", (None,)), ("ivf", "nprobe", nprobes), ("hnsw", "efSearch", ef_searches)):
+        t0 = time.time()
+        index = build_ann_index(E, variant)
+        build_s = time.time() - t0
+        for value in values:
+            if variant == "ivf":
+                set_ann_params(index, nprobe=value)
+            elif variant == "hnsw":
+                set_ann_params(index, ef_search=value)
+            t0 = time.time()
+            _, I = index.search(Q, k)
+            latency_ms = (time.time() - t0) * 1000 / len(Q)
+            recall = np.mean([len(set(found) & set(exp)) / k for found, exp in zip(I, truth)])
+            rows.append({"variante": f"FAISS {variant.upper()}",
+                         "parámetro": "-" if value is None else f"{label}={value}",
+                         "construcción_s": round(build_s, 3), "latencia_ms": round(latency_ms, 3),
+                         f"recall@{k}": round(float(recall), 3)})
+    return rows
+
+
+# ---------------------------
+# Almacén de índices en disco
+# ---------------------------
+class IndexStore:
+    """
+    Chunks e índices persistidos por (hash del PDF, chunk_size, overlap, tipo de índice), compartidos
+    por todas las sesiones. Cada entrada es un directorio que se publica con un rename atómico;
+    al superar max_bytes se borran las entradas usadas hace más tiempo (mtime del directorio) hasta
+    quedar en LOW_WATER · max_bytes. El tamaño total se lleva en memoria, como en DiskLRUCache: el
+    almacén solo se recorre entero al pasarse del límite.
+    """
+
+    LOW_WATER = 0.9
+
+    def __init__(self, root, max_bytes: int = 1024 * 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = sum(size for _, size, _ in self._scan())
+
+    def _dir(self, digest: str, chunk_size: int, overlap: int, kind: str) -> Path:
+        return self.root / make_key(digest, chunk_size, overlap, kind)
+
+    def _read(self, path: Path, read):
+        """
+        Lee una entrada con read(path). Si falta devuelve None; si no se puede leer (formato de otra
+        versión, fichero truncado, expulsada por otra sesión a mitad de lectura) la borra y devuelve
+        None para que el llamante la reconstruya.
+        """
+        if not path.is_dir():
+            return None
+        try:
+            os.utime(path)
+            return read(path)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+    def _publish(self, path: Path, write) -> None:
+        tmp = Path(tempfile.mkdtemp(dir=self.root, prefix=".tmp-"))
+        try:
+            write(tmp)
+            size = self._entry_size(tmp)
+            os.replace(tmp, path)
+        except OSError:
+            # Otra sesión publicó la misma entrada antes: vale la suya
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not path.is_dir():
+                raise
+            return
+        with self._lock:
+            self._total += size
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def load_chunks(self, digest: str, chunk_size: int, overlap: int) -> Optional[List[str]]:
+        def read(path: Path):
+            with open(path / "chunks.json", encoding="utf-8") as f:
+                return json.load(f)
+        return self._read(self._dir(digest, chunk_size, overlap, "chunks"), read)
+
+    def save_chunks(self, digest: str, chunk_size: int, overlap: int, chunks: List[str]) -> None:
+        def write(tmp: Path):
+            with open(tmp / "chunks.json", "w", encoding="utf-8") as f:
+                json.dump(chunks, f, ensure_ascii=False)
+        self._publish(self._dir(digest, chunk_size, overlap, "chunks"), write)
+
+    def load_index(self, digest: str, chunk_size: int, overlap: int, kind: str, chunks: List[str]):
+        def read(path: Path):
+            if kind == TFIDFIndexer.kind:
+                return TFIDFIndexer.load(path, chunks)
+            return EmbeddingIndexer.load(path, chunks, model_name=kind.split(":", 1)[1])
+        return self._read(self._dir(digest, chunk_size, overlap, kind), read)
+
+    def save_index(self, digest: str, chunk_size: int, overlap: int, index) -> None:
+        self._publish(self._dir(digest, chunk_size, overlap, index.kind), index.save)
+
+    # Índices FAISS: entrada propia por variante junto a los embeddings de los que salen
+    def load_ann(self, digest: str, chunk_size: int, overlap: int, kind: str, variant: str, n: int):
+        def read(path: Path):
+            ann_index = faiss.read_index(str(path / "ann.faiss"))
+            if ann_index.ntotal != n:
+                raise ValueError("Índice ANN inconsistente con sus embeddings")
+            return ann_index
+        return self._read(self._dir(digest, chunk_size, overlap, f"{kind}:ann:{variant}"), read)
+
+    def save_ann(self, digest: str, chunk_size: int, overlap: int, kind: str, variant: str, ann_index) -> None:
+        self._publish(self._dir(digest, chunk_size, overlap, f"{kind}:ann:{variant}"),
+                      lambda tmp: faiss.write_index(ann_index, str(tmp / "ann.faiss")))
+
+    @staticmethod
+    def _entry_size(path: Path) -> int:
+        return sum(f.stat().st_size for f in path.iterdir())
+
+    def _scan(self):
+        entries = []
+        for d in self.root.iterdir():
+            if d.name.startswith(".tmp-") or not d.is_dir():
+                continue
+            try:
+                entries.append((d.stat().st_mtime, self._entry_size(d), d))
+            except OSError:
+                continue  # borrada por otra sesión mientras se recorría
+        return entries
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            self._total = total
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            target = int(self.max_bytes * self.LOW_WATER)
+            for _, size, d in entries:
+                if total <= target:
+                    break
+                shutil.rmtree(d, ignore_errors=True)
+                total -= size
+            self._total = total
+
+
+@st.cache_resource(show_spinner=False)
+def index_store() -> IndexStore:
+    return IndexStore(CACHE_ROOT / "indices_pdf")
+
+
+def pages_key(digest: str, ocr: bool) -> str:
+    """
+    Clave de almacén de los chunks por página de un PDF (compartidos por el modo simple y la colección).
+    Incluye si hubo OCR de verdad: un resultado sin OCR no debe servirse cuando se pide con OCR.
+    """
+    return f"{digest}:paginas:{'ocr' if ocr and _OCR_OK else 'texto'}"
+
+
+def ingest_pdf(data: bytes, digest: str, chunk_size: int, overlap: int, use_embeddings: bool = False,
+               workers: int = 4, ocr: bool = True, on_page=None):
+    """
+    Extrae en paralelo, trocea cada página al terminar y, con embeddings, la codifica mientras el pool
+    sigue extrayendo el resto. Guarda chunks (y embeddings) en el almacén y devuelve
+    (filas (página, chunk) en orden, registros por página). on_page(registro, hechas, total) informa del avance.
+    """
+    n_pages = len(PdfReader(io.BytesIO(data)).pages)
+    model = load_sentence_model(DEFAULT_EMB_MODEL) if use_embeddings else None
+    by_page, emb_by_page, records = {}, {}, []
+    for rec, rows in stream_page_chunks(data, chunk_size, overlap, workers, ocr):
+        records.append(rec)
+        by_page[rec["pagina"]] = rows
+        if model is not None and rows:
+            emb_by_page[rec["pagina"]] = model.encode([text for _, text in rows], normalize_embeddings=True,
+                                                      show_progress_bar=False)
+        if on_page is not None:
+            on_page(rec, len(records), n_pages)
+
+    pages = sorted(by_page)
+    rows = [row for page in pages for row in by_page[page]]
+    store, key = index_store(), pages_key(digest, ocr)
+    store.save_chunks(key, chunk_size, overlap, rows)
+    if model is not None and rows:
+        index = EmbeddingIndexer()
+        index.fit([text for _, text in rows], embeddings=np.concatenate([emb_by_page[p] for p in pages if p in emb_by_page]))
+        store.save_index(key, chunk_size, overlap, index)
+    records.sort(key=lambda r: r["pagina"])
+    return rows, records
+
+
+def load_or_build_index(digest: str, chunk_size: int, overlap: int, chunks: List[str], use_embeddings: bool,
+                        ann: Optional[str] = None, nprobe: int = 8, ef_search: int = 64):
+    """
+    Índice desde el almacén en disco o, si no existe, ajustado y guardado. Con embeddings y una variante
+    ANN, el índice FAISS también se lee del almacén (o se construye y guarda una vez); nprobe y efSearch
+    solo se aplican sobre él. Devuelve (índice, desde_disco).
+    """
+    store = index_store()
+    kind = f"emb:{DEFAULT_EMB_MODEL}" if use_embeddings else TFIDFIndexer.kind
+    index = store.load_index(digest, chunk_size, overlap, kind, chunks)
+    cached = index is not None
+    if not cached:
+        index = EmbeddingIndexer() if use_embeddings else TFIDFIndexer(stoplist=STOPLIST)
+        index.fit(chunks)
+        store.save_index(digest, chunk_size, overlap, index)
+    if not use_embeddings:
+        return index, cached
+
+    index.set_search_params(nprobe, ef_search)
+    if ann and _FAISS_OK:
+        ann_index = store.load_ann(digest, chunk_size, overlap, kind, ann, len(chunks)) if cached else None
+        if ann_index is None:
+            ann_index = build_ann_index(index._E, ann)
+            store.save_ann(digest, chunk_size, overlap, kind, ann, ann_index)
+        index.attach_ann(ann, ann_index)
+    return index, cached
+
+
+# ---------------------------
+# Colección de documentos
+# ---------------------------
+# Vectorizador sin estado: los documentos nuevos no obligan a reajustar un vocabulario
+_HASH_FEATURES = 2 ** 20
+_HASHER = HashingVectorizer(
+    n_features=_HASH_FEATURES, ngram_range=(1, 2), stop_words=STOPLIST, alternate_sign=False, norm=None
+)
+
+
+def _log_tf(texts: List[str]):
+    X = _HASHER.transform(texts).tocsr()
+    X.data = 1.0 + np.log(X.data)
+    return X
+
+
+class CorpusIndex:
+    """
+    Colección de PDFs con altas y bajas incrementales; cada chunk recuerda su documento y página.
+    Cada documento se vectoriza una vez y se guarda como un bloque propio:
+    - TF-IDF (esquema SMART lnc.ltc): los chunks llevan tf logarítmico normalizado sin IDF, y el IDF
+      se aplica solo a la consulta con frecuencias de documento acumuladas, así añadir o quitar un
+      documento no cambia los vectores de los demás. La consulta lee solo las columnas de sus términos.
+    - Embeddings: matriz por documento (persistida en el IndexStore); con FAISS se añade al índice ANN
+      común, que solo se reconstruye tras una baja.
+    """
+
+    def __init__(self, chunk_size: int, overlap: int, use_embeddings: bool = False, ann: Optional[str] = None,
+                 nprobe: int = 8, ef_search: int = 64, workers: int = 4, ocr: bool = True):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.use_embeddings = use_embeddings
+        self.ann = ann if _FAISS_OK else None
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.workers = workers
+        self.ocr = ocr
+        self.docs = {}
+        self._df = np.zeros(_HASH_FEATURES, dtype=np.float64)
+        self._n_chunks = 0
+        self._ann_index = None
+        self._ann_ids = []
+
+    def __len__(self) -> int:
+        return self._n_chunks
+
+    def add(self, name: str, data: bytes, digest: Optional[str] = None) -> int:
+        """Añade un PDF (si no estaba) y devuelve cuántos chunks aporta."""
+        digest = digest or hashlib.sha256(data).hexdigest()
+        if digest in self.docs:
+            return 0
+        store = index_store()
+        key = pages_key(digest, self.ocr)
+        rows = store.load_chunks(key, self.chunk_size, self.overlap)
+        if rows is None:
+            rows = extract_page_chunks(data, self.chunk_size, self.overlap, self.workers, self.ocr)
+            store.save_chunks(key, self.chunk_size, self.overlap, rows)
+        texts = [text for _, text in rows]
+
+        doc = {"name": name, "pages": np.array([p for p, _ in rows], dtype=np.int32), "texts": texts,
+               "X": None, "E": None}
+        if texts:
+            X = normalize(_log_tf(texts))
+            self._df += np.bincount(X.indices, minlength=_HASH_FEATURES)
+            doc["X"] = X.tocsc()
+            if self.use_embeddings:
+                doc["E"] = load_or_build_index(key, self.chunk_size, self.overlap, texts, True)[0]._E
+                if self._ann_index is not None:
+                    self._ann_index.add(np.ascontiguousarray(doc["E"], dtype=np.float32))
+                    self._ann_ids.extend((digest, i) for i in range(len(texts)))
+        self.docs[digest] = doc
+        self._n_chunks += len(texts)
+        return len(texts)
+
+    def remove(self, digest: str) -> None:
+        doc = self.docs.pop(digest, None)
+        if doc is None:
+            return
+        if doc["X"] is not None:
+            self._df -= np.bincount(doc["X"].tocsr().indices, minlength=_HASH_FEATURES)
+        self._n_chunks -= len(doc["texts"])
+        # Los índices ANN no admiten borrado en general: se reconstruye en la siguiente consulta
+        self._ann_index, self._ann_ids = None, []
+
+    def _tfidf_candidates(self, q: str, top_k: int):
+        qv = _log_tf([q])
+        terms = qv.indices
+        idf = np.log((self._n_chunks + 1) / (self._df[terms] + 1)) + 1.0
+        w = qv.data * idf
+        w /= max(np.linalg.norm(w), 1e-12)
+        for digest, doc in self.docs.items():
+            if doc["X"] is None or not len(terms):
+                continue
+            yield digest, np.asarray(doc["X"][:, terms] @ w).ravel()
+
+    def _embedding_candidates(self, q: str, top_k: int):
+        q_emb = load_sentence_model(DEFAULT_EMB_MODEL).encode([q], normalize_embeddings=True,
+                                                              show_progress_bar=False)[0]
+        if not self.ann:
+            for digest, doc in self.docs.items():
+                if doc["E"] is not None:
+                    yield digest, doc["E"] @ q_emb
+            return
+        if self._ann_index is None:
+            blocks = [(d, doc["E"]) for d, doc in self.docs.items() if doc["E"] is not None]
+            if not blocks:
+                return
+            self._ann_index = build_ann_index(np.concatenate([E for _, E in blocks]), self.ann)
+            self._ann_ids = [(d, i) for d, E in blocks for i in range(len(E))]
+        set_ann_params(self._ann_index, self.nprobe, self.ef_search)
+        D, I = self._ann_index.search(np.asarray(q_emb, dtype=np.float32)[None, :], top_k)
+        by_doc = {}
+        for i, score in zip(I[0], D[0]):
+            if i >= 0:
+                d, local = self._ann_ids[i]
+                by_doc.setdefault(d, {})[local] = float(score)
+        for d, hits in by_doc.items():
+            scores = np.full(len(self.docs[d]["texts"]), -np.inf)
+            scores[list(hits)] = list(hits.values())
+            yield d, scores
+
+    def query(self, q: str, top_k: int = 3) -> List[dict]:
+        """Mejores chunks de toda la colección: dicts con documento, página, score y texto."""
+        if not self._n_chunks:
+            return []
+        candidates = self._embedding_candidates(q, top_k) if self.use_embeddings else self._tfidf_candidates(q, top_k)
+        hits = []
+        for digest, scores in candidates:
+            k = min(top_k, len(scores))
+            for i in np.argpartition(-scores, k - 1)[:k]:
+                if np.isfinite(scores[i]):
+                    hits.append((float(scores[i]), digest, int(i)))
+        hits.sort(key=lambda h: -h[0])
+        return [{
+            "documento": self.docs[d]["name"], "pagina": int(self.docs[d]["pages"][i]),
+            "score": score, "texto": self.docs[d]["texts"][i],
+        } for score, d, i in hits[:top_k]]
+
+
+def _render_page_timings(records: List[dict]):
+    times = np.array([r["segundos"] for r in records])
+    slow = [r["pagina"] for r in records if r["segundos"] > max(3 * np.median(times), 1.0)]
+    n_ocr = sum(r["metodo"] == "ocr" for r in records)
+    with st.expander(f"Tiempos por página ({n_ocr} con OCR, {len(slow)} lentas)", expanded=bool(slow)):
+        if slow:
+            st.warning(f"Páginas anómalamente lentas: {', '.join(map(str, slow))}.")
+        st.dataframe([{
+            "pagina": r["pagina"], "metodo": r["metodo"], "segundos": r["segundos"],
+            "caracteres": len(r["texto"]), "error": r["error"] or "",
+        } for r in records], use_container_width=True)
+
+
+def _render_corpus(chunk_size: int, overlap: int, use_emb: bool, ann_options: dict, workers: int = 4,
+                   ocr: bool = True):
+    files = st.file_uploader("Sube uno o varios PDFs", type=["pdf"], accept_multiple_files=True, key="corpus_pdfs")
+
+    # Solo lo que cambia los vectores o la estructura del índice obliga a empezar la colección de nuevo
+    params = (chunk_size, overlap, use_emb, ann_options["ann"] if use_emb else None)
+    if st.session_state.get("pdf_corpus_params") != params:
+        st.session_state["pdf_corpus"] = CorpusIndex(chunk_size, overlap, use_emb, **ann_options)
+        st.session_state["pdf_corpus_params"] = params
+    corpus = st.session_state["pdf_corpus"]
+    # Se aplican en el sitio: parámetros de búsqueda ANN y de extracción de documentos nuevos
+    corpus.nprobe, corpus.ef_search = ann_options["nprobe"], ann_options["ef_search"]
+    corpus.workers, corpus.ocr = workers, ocr
+
+    # La colección sigue a la lista de subidas: solo se indexan las altas y se quitan las bajas
+    uploaded = {hashlib.sha256(f.getvalue()).hexdigest(): f for f in files or []}
+    for digest in [d for d in corpus.docs if d not in uploaded]:
+        corpus.remove(digest)
+    new = [(d, f) for d, f in uploaded.items() if d not in corpus.docs]
+    if new:
+        progress = st.progress(0.0, text="Indexando documentos nuevos...")
+        t0 = time.time()
+        for n, (digest, f) in enumerate(new, start=1):
+            added = corpus.add(f.name, f.getvalue(), digest)
+            if not added:
+                st.warning(f"No se pudo extraer texto utilizable de {f.name}.")
+            progress.progress(n / len(new), text=f"{n}/{len(new)} documentos · {f.name}")
+        progress.empty()
+        st.caption(f"{len(new)} documento(s) añadidos en {time.time() - t0:.1f}s.")
+
+    if not corpus.docs:
+        return
+    st.success(f"Colección: {len(corpus.docs)} documento(s), {len(corpus)} chunks.")
+
+    st.markdown("---")
+    q = st.text_input("Pregunta", key="corpus_q")
+    topk = st.slider("Resultados a mostrar", 1, 10, 5, 1, key="corpus_topk")
+    threshold = st.slider("Umbral de similitud", 0.0, 1.0, 0.15, 0.01, key="corpus_threshold")
+    if not q:
+        return
+
+    t0 = time.time()
+    with st.spinner("Buscando en la colección..."):
+        hits = [h for h in corpus.query(q, top_k=topk) if h["score"] >= threshold]
+    st.caption(f"Consulta en {(time.time() - t0) * 1000:.0f} ms.")
+    if not hits:
+        st.warning("No hay fragmentos suficientemente relevantes. Reformula la pregunta o ajusta el umbral.")
+        return
+    for h in hits:
+        st.markdown(f"**{h['documento']} — pág. {h['pagina']} — score: {h['score']:.3f}**")
+        st.write(h["texto"])
+        st.markdown("---")
+
 
 # ---------------------------
 # Página
@@ -136,6 +809,32 @@ def render():
             use_embeddings = st.checkbox("Usar embeddings (sentence-transformers)", value=False, disabled=not _EMB_OK)
         if not _EMB_OK and use_embeddings:
             st.warning("sentence-transformers no está disponible; usando TF-IDF.")
+        col_d, col_e, col_f = st.columns(3)
+        with col_d:
+            ann_label = st.selectbox(
+                "Búsqueda de vecinos (embeddings)", list(ANN_VARIANTS.keys()), index=0,
+                disabled=not (_EMB_OK and _FAISS_OK and use_embeddings),
+                help="FAISS evita recorrer todos los chunks; útil con colecciones grandes."
+            )
+        ann = ANN_VARIANTS[ann_label] if (_FAISS_OK and use_embeddings) else None
+        with col_e:
+            nprobe = st.slider("nprobe (IVF)", 1, 128, 8, disabled=ann != "ivf")
+        with col_f:
+            ef_search = st.slider("efSearch (HNSW)", 8, 512, 64, 8, disabled=ann != "hnsw")
+        col_g, col_h = st.columns(2)
+        with col_g:
+            workers = st.slider("Procesos de extracción", 1, max(os.cpu_count() or 1, 1), min(4, os.cpu_count() or 1))
+        with col_h:
+            ocr = st.checkbox("OCR en páginas sin texto (escaneadas)", value=_OCR_OK, disabled=not _OCR_OK)
+
+    use_emb = use_embeddings and _EMB_OK
+    ann_options = {"ann": ann, "nprobe": nprobe, "ef_search": ef_search}
+
+    mode = st.radio("Modo", ["Un PDF", "Colección de PDFs"], horizontal=True,
+                    help="La colección permite añadir y quitar documentos sin reindexar los demás.")
+    if mode == "Colección de PDFs":
+        _render_corpus(chunk_size, overlap, use_emb, ann_options, workers, ocr)
+        return
 
     uploaded = st.file_uploader("Sube un PDF", type=["pdf"])
 
@@ -143,62 +842,69 @@ def render():
         return
 
     if st.button("Procesar PDF"):
-        with st.spinner("Extrayendo texto..."):
-            raw_text = extract_text_from_pdf(uploaded.read())
-
-        if not raw_text or not raw_text.strip():
-            st.error("No se pudo extraer texto utilizable del PDF.")
-            return
-
-        with st.spinner("Construyendo chunks..."):
-            chunks = make_chunks(raw_text, chunk_size=chunk_size, overlap=overlap)
-
-        st.success(f"Procesado. Chunks: {len(chunks)}")
-        st.session_state["pdf_chunks"] = chunks
+        data = uploaded.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        key = pages_key(digest, ocr)
+        t0 = time.time()
+        rows = index_store().load_chunks(key, chunk_size, overlap)
+        if rows is None:
+            progress = st.progress(0.0, text="Extrayendo páginas...")
+
+            def on_page(rec, done, total):
+                progress.progress(done / max(total, 1), text=(
+                    f"{done}/{total} páginas · pág. {rec['pagina']}: {rec['segundos']:.2f}s ({rec['metodo']})"
+                ))
+
+            rows, records = ingest_pdf(data, digest, chunk_size, overlap, use_emb, workers, ocr, on_page)
+            progress.empty()
+            if not rows:
+                st.error("No se pudo extraer texto utilizable del PDF.")
+                _render_page_timings(records)
+                return
+            st.success(f"Procesado en {time.time() - t0:.1f}s. Páginas: {len(records)} · Chunks: {len(rows)}")
+            _render_page_timings(records)
+        else:
+            st.success(f"Chunks recuperados del disco en {(time.time() - t0) * 1000:.0f} ms. Chunks: {len(rows)}")
+        st.session_state["pdf_chunks"] = [text for _, text in rows]
+        st.session_state["pdf_pages"] = [page for page, _ in rows]
+        st.session_state["pdf_key"] = (key, chunk_size, overlap)
         st.session_state["pdf_ready"] = True
 
     if not st.session_state.get("pdf_ready"):
         return
 
     chunks = st.session_state["pdf_chunks"]
-
-    # Construir índice bajo demanda o si se cambia el modo
-    if use_embeddings and _EMB_OK:
-        if "emb_index" not in st.session_state or st.session_state.get("emb_index_params") != (len(chunks), chunk_size, overlap):
-            with st.spinner("Indexando (embeddings)..."):
-                emb_index = EmbeddingIndexer()
-                emb_index.fit(chunks)
-                st.session_state["emb_index"] = emb_index
-                st.session_state["emb_index_params"] = (len(chunks), chunk_size, overlap)
-        indexer = st.session_state["emb_index"]
-        score_label = "sim_emb"
-    else:
-        # Stoplist simple ES+EN sin NLTK para evitar descargas
-        stoplist = [
-            "de","la","que","el","en","y","a","los","del","se","las","por","un","para","con","no","una",
-            "su","al","lo","como","más","pero","sus","le","ya","o","este","sí","porque","esta","entre",
-            "cuando","muy","sin","sobre","también","me","hasta","hay","donde","quien","desde","todo",
-            "nos","durante","todos","uno","les","ni","contra","otros","ese","eso","ante","ellos","e",
-            "esto","mí","antes","algunos","qué","unos","yo","otro","otras","otra","él","tanto","esa","estos",
-            "mucho","quienes","nada","muchos","cual","poco","ella","estar","estas","algunas","algo","nosotros",
-            "mi","mis","tú","te","ti","tu","tus","ellas","nosotras","vosotros","vosotras","os","mío","mía",
-            "míos","mías","tuyo","tuya","tuyos","tuyas","suyo","suya","suyos","suyas","nuestro","nuestra",
-            "nuestros","nuestras","vuestro","vuestra","vuestros","vuestras","esos","esas","estoy","estás",
-            "está","estamos","estáis","están","esté","estés","estemos","estéis","estén","estaré","estarás",
-            "estará","estaremos","estaréis","estarán","he","has","ha","hemos","habéis","han","haya","hayas",
-            "ing","the","and","to","of","in","that","is","for","on","it","with","as","are","was","at","by",
-            "be","this","from","or","an","which","but","not","have","has","had","were","their","they","you",
-            "we","his","her","its","can","all","one","more","about","there","been","if","when","who","will",
-            "would","what","so","no","up","out","do","into","than","your","them","could","my","over","some"
-        ]
-        if "tfidf_index" not in st.session_state or st.session_state.get("tfidf_index_params") != (len(chunks), chunk_size, overlap):
-            with st.spinner("Indexando (TF-IDF)..."):
-                tfidf_index = TFIDFIndexer(stoplist=stoplist)
-                tfidf_index.fit(chunks)
-                st.session_state["tfidf_index"] = tfidf_index
-                st.session_state["tfidf_index_params"] = (len(chunks), chunk_size, overlap)
-        indexer = st.session_state["tfidf_index"]
-        score_label = "sim_tfidf"
+    pages = st.session_state.get("pdf_pages")
+    digest, chunk_size, overlap = st.session_state["pdf_key"]
+
+    # Índice bajo demanda o si cambia el modo: primero en sesión, luego en disco
+    # nprobe/efSearch no forman parte de la clave: se aplican sobre el índice ya cargado
+    index_params = (digest, chunk_size, overlap, use_emb, ann if use_emb else None)
+    if st.session_state.get("pdf_index_params") != index_params:
+        with st.spinner("Indexando (embeddings)..." if use_emb else "Indexando (TF-IDF)..."):
+            t0 = time.time()
+            indexer, cached = load_or_build_index(digest, chunk_size, overlap, chunks, use_emb, **ann_options)
+            elapsed = time.time() - t0
+        st.session_state["pdf_index"] = indexer
+        st.session_state["pdf_index_params"] = index_params
+        st.caption(
+            f"Índice {'cargado del disco' if cached else 'construido y guardado'} en {elapsed * 1000:.0f} ms."
+        )
+    indexer = st.session_state["pdf_index"]
+    if use_emb:
+        indexer.set_search_params(nprobe, ef_search)
+    score_label = "sim_emb" if use_emb else "sim_tfidf"
+
+    if use_emb and _FAISS_OK:
+        with st.expander("Comparar búsqueda ANN vs exacta (recall@k y latencia)", expanded=False):
+            bench_k = st.slider("k", 1, 20, 5, key="ann_bench_k")
+            if st.button("Ejecutar comparación ANN"):
+                with st.spinner("Construyendo índices FAISS y midiendo..."):
+                    try:
+                        st.dataframe(benchmark_ann(indexer._E, k=bench_k), use_container_width=True)
+                    except Exception as e:
+                        st.error(f"Error en la comparación: {e}")
+                st.caption("Consultas: embeddings de chunks al azar. Verdad: top-k exacto por producto interno.")
 
     st.markdown("---")
     q = st.text_input("Pregunta")
@@ -214,7 +920,8 @@ def render():
             if score < threshold:
                 continue
             frag = chunks[i]
-            st.markdown(f"**Fragmento {i} — {score_label}: {score:.3f}**")
+            where = f" (pág. {pages[i]})" if pages else ""
+            st.markdown(f"**Fragmento {i}{where} — {score_label}: {score:.3f}**")
             st.write(frag)
             st.markdown("---")
             shown = True
@@ -3,47 +3,735 @@ from PIL import Image
 import numpy as np
 import pandas as pd
 import io
+import os
+import time
+import zipfile
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
 import torch
 import cv2
 
 from ultralytics import YOLO
+from ultralytics.engine.results import Results
+from ultralytics.utils.plotting import colors
+
+from modules.cache_disco import CACHE_ROOT
+
+# Bloqueo entre procesos (POSIX); sin él la exportación solo queda protegida por el os.replace final
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EXPORT_DIR = CACHE_ROOT / "yolo_export"
+BACKENDS = {
+    "PyTorch (.pt)": "pytorch",
+    "ONNX Runtime": "onnx",
+    "ONNX Runtime int8": "onnx-int8",
+}
+
+
+@contextmanager
+def _export_lock():
+    """Serializa exportación y cuantización entre sesiones y procesos (flock sobre EXPORT_DIR/.lock)."""
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(EXPORT_DIR / ".lock", "w") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def export_onnx(model_name: str, int8: bool = False) -> Path:
+    """
+    Exporta los pesos .pt a ONNX una sola vez (y opcionalmente una variante int8) y devuelve la ruta en caché.
+    Se trabaja en un directorio temporal dentro de EXPORT_DIR y se publica con os.replace, así nadie
+    carga un .onnx a medio escribir.
+    """
+    stem = Path(model_name).stem
+    target = EXPORT_DIR / f"{stem}.onnx"
+    qtarget = EXPORT_DIR / f"{stem}_int8.onnx"
+    if target.exists() and (not int8 or qtarget.exists()):
+        return qtarget if int8 else target
+    with _export_lock():
+        if not target.exists():
+            with tempfile.TemporaryDirectory(dir=EXPORT_DIR, prefix=".tmp-") as tmp:
+                # Ultralytics escribe el .onnx junto al .pt: exportar desde una copia en el temporal
+                weights = Path(tmp) / Path(model_name).name
+                shutil.copy(YOLO(model_name).ckpt_path, weights)
+                # Lote dinámico para poder usar predict por lotes con el grafo exportado
+                exported = YOLO(str(weights)).export(format="onnx", dynamic=True)
+                os.replace(exported, target)
+        if int8 and not qtarget.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            with tempfile.TemporaryDirectory(dir=EXPORT_DIR, prefix=".tmp-") as tmp:
+                out = Path(tmp) / qtarget.name
+                quantize_dynamic(str(target), str(out), weight_type=QuantType.QUInt8)
+                os.replace(out, qtarget)
+    return qtarget if int8 else target
+
 
 @st.cache_resource(show_spinner=False)
-def load_model(model_name: str):
+def load_model(model_name: str, backend: str = "pytorch"):
+    if backend != "pytorch":
+        # Ultralytics ejecuta los .onnx con onnxruntime y devuelve los mismos Results
+        path = export_onnx(model_name, int8=backend == "onnx-int8")
+        return YOLO(str(path), task="detect"), "cpu/onnxruntime"
     model = YOLO(model_name)
     device = "cuda" if torch.cuda.is_available() else "cpu"
     model.to(device)
     return model, device
 
-def bgr_to_rgb(img_bgr: np.ndarray) -> np.ndarray:
-    return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-
 def results_to_dataframe(res) -> pd.DataFrame:
     boxes = res.boxes
     if boxes is None or boxes.data is None or len(boxes) == 0:
         return pd.DataFrame(columns=["clase", "confianza", "x1", "y1", "x2", "y2"])
-    xyxy = boxes.xyxy.cpu().numpy()
-    cls = boxes.cls.cpu().numpy().astype(int)
-    conf = boxes.conf.cpu().numpy()
+    # Una sola copia al host: columnas x1, y1, x2, y2, [id,] conf, cls
+    data = boxes.data.cpu().numpy().astype(np.float64)
+    data = data[np.argsort(-data[:, -2], kind="stable")]
+    cls = data[:, -1].astype(int)
+    # Tabla de nombres indexada por clase: el coste depende del nº de clases, no de cajas
     names = res.names
-    rows = []
-    for i in range(len(xyxy)):
-        x1, y1, x2, y2 = xyxy[i]
+    lut = np.array([names.get(i, str(i)) for i in range(cls.max() + 1)], dtype=object)
+    return pd.DataFrame({
+        "clase": lut[cls], "confianza": data[:, -2],
+        "x1": data[:, 0], "y1": data[:, 1], "x2": data[:, 2], "y2": data[:, 3],
+    })
+
+
+def encode_png(img_bgr: np.ndarray) -> bytes:
+    ok, png = cv2.imencode(".png", img_bgr)
+    if not ok:
+        raise RuntimeError("No se pudo codificar la imagen.")
+    return png.tobytes()
+
+# ---------------------------
+# Lotes de imágenes y vídeo
+# ---------------------------
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+VIDEO_TYPES = ["mp4", "avi", "mov", "mkv", "webm"]
+
+
+def iter_image_inputs(files):
+    """Genera (nombre, imagen BGR) de cada imagen subida o contenida en un ZIP."""
+    for f in files:
+        if f.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(f.getvalue())) as zf:
+                for info in zf.infolist():
+                    name = info.filename
+                    if info.is_dir() or not name.lower().endswith(IMAGE_EXTS) or "__MACOSX" in name:
+                        continue
+                    img = cv2.imdecode(np.frombuffer(zf.read(info), np.uint8), cv2.IMREAD_COLOR)
+                    if img is not None:
+                        yield name, img
+        else:
+            img = cv2.imdecode(np.frombuffer(f.getvalue(), np.uint8), cv2.IMREAD_COLOR)
+            if img is not None:
+                yield f.name, img
+
+
+def count_image_inputs(files) -> int:
+    total = 0
+    for f in files:
+        if f.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(f.getvalue())) as zf:
+                total += sum(1 for i in zf.infolist()
+                             if not i.is_dir() and i.filename.lower().endswith(IMAGE_EXTS) and "__MACOSX" not in i.filename)
+        else:
+            total += 1
+    return total
+
+
+def iter_video_frames(path: str, stride: int = 1):
+    """
+    Genera (índice, frame BGR) cada `stride` frames. Los intermedios se avanzan con grab(), que también
+    decodifica, pero se ahorran retrieve() y la conversión de color.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        idx = 0
+        while True:
+            if idx % stride:
+                if not cap.grab():
+                    break
+            else:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield idx, frame
+            idx += 1
+    finally:
+        cap.release()
+
+
+def predict_batches(model, items, conf: float, batch_size: int = 8):
+    """Agrupa (clave, imagen BGR) en lotes para model.predict. Genera (clave, imagen, resultado)."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield from _predict_batch(model, batch, conf)
+            batch = []
+    if batch:
+        yield from _predict_batch(model, batch, conf)
+
+
+def _predict_batch(model, batch, conf: float):
+    results = model.predict([img for _, img in batch], conf=conf, verbose=False)
+    for (key, img), res in zip(batch, results):
+        yield key, img, res
+
+
+def _open_video_writer(path: str, fps: float, size):
+    # avc1 (H.264) se reproduce en el navegador; si OpenCV no lo trae, mp4v
+    for codec in ("avc1", "mp4v"):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if writer.isOpened():
+            return writer
+    raise RuntimeError("No se pudo crear el vídeo de salida.")
+
+
+def _save_upload(uploaded) -> str:
+    # OpenCV necesita una ruta para leer el contenedor de vídeo
+    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(uploaded.name).suffix) as tmp:
+        tmp.write(uploaded.getvalue())
+        return tmp.name
+
+
+def _video_info(path: str):
+    """(fps, nº de frames, (ancho, alto)) del vídeo."""
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    finally:
+        cap.release()
+    return fps, total, size
+
+
+def _tagged_dataframe(res, key_col: str, key) -> pd.DataFrame:
+    df = results_to_dataframe(res)
+    df.insert(0, key_col, key)
+    return df
+
+
+def annotated_name(name: str, used: set) -> str:
+    """
+    Nombre en el ZIP de salida: conserva la ruta relativa y la extensión original (a/x.jpg →
+    a/x_jpg_detecciones.png), y numera si aun así se repite (mismo nombre subido dos veces).
+    """
+    p = PurePosixPath(name)
+    base = str(p.with_suffix("")) + (f"_{p.suffix[1:]}" if p.suffix else "") + "_detecciones"
+    out, n = f"{base}.png", 1
+    while out in used:
+        n += 1
+        out = f"{base}_{n}.png"
+    used.add(out)
+    return out
+
+
+def _render_image_batch(model_choice: str, conf_th: float, backend: str = "pytorch"):
+    files = st.file_uploader(
+        "Sube varias imágenes o un ZIP con una carpeta de imágenes",
+        type=["jpg", "jpeg", "png", "webp", "bmp", "zip"],
+        accept_multiple_files=True
+    )
+    batch_size = st.slider("Tamaño de lote", 1, 32, 8)
+    annotate = st.checkbox("Generar ZIP con imágenes anotadas", value=True,
+                           help="Desactívalo si solo necesitas la tabla: se evita dibujar y codificar cada imagen.")
+    if not files or not st.button("Detectar en lote", use_container_width=True):
+        return
+
+    total = count_image_inputs(files)
+    model, device = load_model(model_choice, backend)
+    progress = st.progress(0.0, text=f"0/{total} imágenes")
+    frames, annotated, used = [], io.BytesIO(), set()
+    t0 = time.time()
+    with zipfile.ZipFile(annotated, "w") as zf:
+        for name, img, res in predict_batches(model, iter_image_inputs(files), conf_th, batch_size):
+            frames.append(_tagged_dataframe(res, "imagen", name))
+            if annotate:
+                zf.writestr(annotated_name(name, used), encode_png(res.plot()))
+            done = len(frames)
+            progress.progress(min(done / max(total, 1), 1.0),
+                              text=f"{done}/{total} imágenes · {done / max(time.time() - t0, 1e-6):.1f} img/s")
+
+    if not frames:
+        st.warning("No se encontraron imágenes válidas.")
+        return
+    df = pd.concat(frames, ignore_index=True)
+    st.success(f"{len(frames)} imágenes en {time.time() - t0:.1f}s ({device}).")
+    st.dataframe(df, use_container_width=True)
+    c1, c2 = st.columns(2)
+    with c1:
+        st.download_button("Descargar detecciones (CSV)", data=df.to_csv(index=False), file_name="detecciones.csv",
+                           mime="text/csv", use_container_width=True)
+    if annotate:
+        with c2:
+            st.download_button("Descargar imágenes anotadas (ZIP)", data=annotated.getvalue(),
+                               file_name="detecciones_yolo.zip", mime="application/zip", use_container_width=True)
+
+
+def _render_video(model_choice: str, conf_th: float, backend: str = "pytorch"):
+    uploaded = st.file_uploader("Sube un vídeo", type=VIDEO_TYPES)
+    c1, c2 = st.columns(2)
+    with c1:
+        batch_size = st.slider("Tamaño de lote", 1, 32, 8)
+    with c2:
+        stride = st.slider("Procesar 1 de cada N frames", 1, 30, 1)
+    if uploaded is None or not st.button("Detectar en vídeo", use_container_width=True):
+        return
+
+    src_path = _save_upload(uploaded)
+    out_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+
+    try:
+        src_fps, total, size = _video_info(src_path)
+        expected = max((total + stride - 1) // stride, 1)
+
+        model, device = load_model(model_choice, backend)
+        writer = _open_video_writer(out_path, src_fps / stride, size)
+        progress = st.progress(0.0, text=f"0/{expected} frames")
+        frames = []
+        t0 = time.time()
+        try:
+            for idx, frame, res in predict_batches(model, iter_video_frames(src_path, stride), conf_th, batch_size):
+                frames.append(_tagged_dataframe(res, "frame", idx))
+                writer.write(res.plot())
+                done = len(frames)
+                progress.progress(min(done / expected, 1.0),
+                                  text=f"{done}/{expected} frames · {done / max(time.time() - t0, 1e-6):.1f} FPS")
+        finally:
+            writer.release()
+        elapsed = time.time() - t0
+
+        if not frames:
+            st.error("No se pudieron leer frames del vídeo.")
+            return
+        with open(out_path, "rb") as f:
+            video_bytes = f.read()
+    except Exception as e:
+        st.error(f"Error al procesar el vídeo: {e}")
+        return
+    finally:
+        for p in (src_path, out_path):
+            if os.path.exists(p):
+                os.remove(p)
+
+    df = pd.concat(frames, ignore_index=True)
+    st.success(f"{len(frames)} frames en {elapsed:.1f}s → {len(frames) / max(elapsed, 1e-6):.1f} FPS ({device}).")
+    st.video(video_bytes)
+    st.subheader("Detecciones por frame")
+    st.dataframe(df, use_container_width=True)
+    c1, c2 = st.columns(2)
+    with c1:
+        st.download_button("Descargar detecciones (CSV)", data=df.to_csv(index=False), file_name="detecciones_video.csv",
+                           mime="text/csv", use_container_width=True)
+    with c2:
+        st.download_button("Descargar vídeo anotado", data=video_bytes, file_name="detecciones_yolo.mp4",
+                           mime="video/mp4", use_container_width=True)
+
+
+# ---------------------------
+# Inferencia por teselas
+# ---------------------------
+def _tile_starts(length: int, tile: int, step: int):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, step))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)  # última tesela pegada al borde
+    return starts
+
+
+def make_tiles(height: int, width: int, tile: int = 640, overlap: float = 0.2):
+    """Ventanas (x1, y1, x2, y2) de lado `tile` que cubren la imagen con el solapamiento indicado."""
+    step = max(int(tile * (1 - overlap)), 1)
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in _tile_starts(height, tile, step)
+        for x in _tile_starts(width, tile, step)
+    ]
+
+
+def _intersection_over_smaller(box: np.ndarray, others: np.ndarray) -> np.ndarray:
+    tl = np.maximum(box[:2], others[:, :2])
+    br = np.minimum(box[2:], others[:, 2:])
+    inter = np.clip(br - tl, 0, None).prod(axis=1)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    return inter / np.maximum(np.minimum(area, areas), 1e-9)
+
+
+GLOBAL_PASS = -1  # origen de las cajas de la pasada a imagen completa
+
+
+def merge_tiled_detections(data: np.ndarray, source: np.ndarray, ios_th: float = 0.6,
+                           iou_th: float = 0.5) -> np.ndarray:
+    """
+    Fusión voraz por clase de filas (x1, y1, x2, y2, conf, cls); `source` es la tesela de cada fila o
+    GLOBAL_PASS. Un objeto cortado por el borde de una tesela deja una caja truncada cuyo IoU con la caja
+    completa suele quedar por debajo de 0.5, así que entre teselas distintas se compara por intersección
+    sobre la caja menor: las que superan ios_th se funden en la caja que las engloba, con la confianza de
+    la mejor. Frente a cajas de la pasada global se usa NMS por IoU: un objeto pequeño dentro de uno
+    grande de la misma clase tiene IoS ≈ 1 y no debe absorberse. Dentro de una misma tesela el modelo ya
+    aplicó NMS.
+    """
+    order = np.argsort(-data[:, 4], kind="stable")
+    data, source = data[order], source[order]
+    alive = np.ones(len(data), dtype=bool)
+    merged = []
+    for i in range(len(data)):
+        if not alive[i]:
+            continue
+        alive[i] = False
+        box = data[i].copy()
+        cand = np.where(alive & (data[:, 5] == box[5]) & (source != source[i]))[0]
+        if len(cand):
+            vs_global = (source[cand] == GLOBAL_PASS) | (source[i] == GLOBAL_PASS)
+            ios = _intersection_over_smaller(box[:4], data[cand, :4])
+            iou = box_iou(box[None, :4], data[cand, :4])[0]
+            fuse = cand[~vs_global & (ios >= ios_th)]
+            alive[cand[vs_global & (iou >= iou_th)]] = False
+            if len(fuse):
+                box[:2] = np.minimum(box[:2], data[fuse, :2].min(axis=0))
+                box[2:4] = np.maximum(box[2:4], data[fuse, 2:4].max(axis=0))
+                alive[fuse] = False
+        merged.append(box)
+    return np.stack(merged) if merged else data[:0]
+
+
+def predict_tiled(model, img_bgr: np.ndarray, conf: float, tile: int = 640, overlap: float = 0.2,
+                  batch_size: int = 8, ios_th: float = 0.6, global_pass: bool = False):
+    """
+    Detecta sobre teselas a resolución nativa (por lotes), devuelve las cajas a coordenadas de la imagen
+    original y funde los duplicados entre teselas (merge_tiled_detections). Devuelve (Results, nº de teselas).
+    """
+    h, w = img_bgr.shape[:2]
+    windows = make_tiles(h, w, tile, overlap)
+    parts, sources = [], []
+    for i in range(0, len(windows), batch_size):
+        chunk = windows[i:i + batch_size]
+        crops = [np.ascontiguousarray(img_bgr[y1:y2, x1:x2]) for x1, y1, x2, y2 in chunk]
+        results = model.predict(crops, conf=conf, imgsz=tile, verbose=False)
+        for t, (x1, y1, _, _), res in zip(range(i, i + len(chunk)), chunk, results):
+            if res.boxes is None or len(res.boxes) == 0:
+                continue
+            data = res.boxes.data[:, :6].cpu().numpy().copy()  # x1, y1, x2, y2, conf, cls
+            data[:, [0, 2]] += x1
+            data[:, [1, 3]] += y1
+            parts.append(data)
+            sources.append(np.full(len(data), t))
+    if global_pass:
+        # Pasada a tamaño normal para objetos grandes que ninguna tesela contiene entero
+        res = model.predict(img_bgr, conf=conf, verbose=False)[0]
+        if res.boxes is not None and len(res.boxes):
+            parts.append(res.boxes.data[:, :6].cpu().numpy())
+            sources.append(np.full(len(res.boxes), GLOBAL_PASS))
+
+    data = np.concatenate(parts).astype(np.float32) if parts else np.zeros((0, 6), dtype=np.float32)
+    if len(data):
+        data = merge_tiled_detections(data, np.concatenate(sources), ios_th)
+    return Results(orig_img=img_bgr, path="", names=model.names, boxes=torch.from_numpy(data)), len(windows)
+
+
+# ---------------------------
+# Comparación PyTorch vs ONNX
+# ---------------------------
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU entre dos conjuntos de cajas xyxy: matriz (len(a), len(b))."""
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(br - tl, 0, None).prod(axis=2)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def _boxes(res):
+    boxes = res.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0, dtype=int)
+    return boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)
+
+
+def agreement(ref, other, iou_th: float = 0.5):
+    """Precisión/recall de `other` tomando `ref` como verdad: coincide misma clase con IoU >= iou_th."""
+    ref_xyxy, ref_cls = _boxes(ref)
+    oth_xyxy, oth_cls = _boxes(other)
+    if len(ref_xyxy) == 0 or len(oth_xyxy) == 0:
+        same = len(ref_xyxy) == len(oth_xyxy)
+        return (1.0 if same else 0.0), (1.0 if same else 0.0)
+    iou = box_iou(oth_xyxy, ref_xyxy) * (oth_cls[:, None] == ref_cls[None, :])
+    # Emparejamiento voraz: cada caja de referencia se usa una sola vez
+    matched, used = 0, np.zeros(len(ref_xyxy), dtype=bool)
+    for i in np.argsort(-iou.max(axis=1)):
+        cand = np.where(used, -1.0, iou[i])
+        j = int(np.argmax(cand))
+        if cand[j] >= iou_th:
+            used[j] = True
+            matched += 1
+    return matched / len(oth_xyxy), matched / len(ref_xyxy)
+
+
+def compare_backends(model_name: str, img: np.ndarray, conf: float, runs: int = 5):
+    """Latencia media (tras un calentamiento) y concordancia con PyTorch de cada backend, sobre la misma imagen."""
+    rows, ref = [], None
+    for label, backend in BACKENDS.items():
+        t0 = time.time()
+        model, device = load_model(model_name, backend)
+        load_time = time.time() - t0
+        res = model.predict(img, conf=conf, verbose=False)[0]  # calentamiento
+        t0 = time.time()
+        for _ in range(runs):
+            res = model.predict(img, conf=conf, verbose=False)[0]
+        latency = (time.time() - t0) / runs
+        if ref is None:
+            ref = res
+        precision, recall = agreement(ref, res)
         rows.append({
-            "clase": names.get(cls[i], str(cls[i])),
-            "confianza": float(conf[i]),
-            "x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)
+            "backend": label, "dispositivo": device, "carga_s": round(load_time, 2),
+            "latencia_ms": round(latency * 1000, 1), "detecciones": len(res.boxes) if res.boxes is not None else 0,
+            "precisión_vs_pt": round(precision, 3), "recall_vs_pt": round(recall, 3),
         })
-    df = pd.DataFrame(rows)
-    df.sort_values(by="confianza", ascending=False, inplace=True, ignore_index=True)
-    return df
+    return pd.DataFrame(rows)
+
+
+# ---------------------------
+# Seguimiento multiobjeto
+# ---------------------------
+def _greedy_match(iou: np.ndarray, iou_th: float):
+    """Pares (fila, columna) por IoU descendente; cada fila y cada columna se usan una sola vez."""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    iou = iou.copy()
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < iou_th:
+            return pairs
+        pairs.append((int(i), int(j)))
+        iou[i, :] = -1.0
+        iou[:, j] = -1.0
+
+
+class Track:
+    def __init__(self, track_id: int, box: np.ndarray, cls: int, conf: float, frame: int):
+        self.id = track_id
+        self.cls = cls
+        self.conf = conf
+        self.box = box.copy()
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.last_box, self.last_frame = box.copy(), frame
+        self.first_frame = frame
+        self.hits, self.lost = 1, 0
+
+
+class IoUTracker:
+    """
+    Seguidor por IoU al estilo ByteTrack. Entre keyframes las cajas avanzan con velocidad constante;
+    en cada keyframe se asocian primero las detecciones de confianza alta y luego las de confianza baja
+    con las pistas que quedaron libres. Solo las detecciones altas abren pistas nuevas, y una pista se
+    muestra tras `min_hits` asociaciones.
+    """
+
+    def __init__(self, high: float = 0.5, low: float = 0.1, iou_th: float = 0.3, max_lost: int = 30,
+                 min_hits: int = 2):
+        self.high = high
+        self.low = min(low, high)
+        self.iou_th = iou_th
+        self.max_lost = max_lost
+        self.min_hits = min_hits
+        self.tracks = []
+        self.next_id = 1
+
+    def step(self, frames: int = 1):
+        for t in self.tracks:
+            t.box = t.box + t.velocity * frames
+
+    def _associate(self, tracks, xyxy: np.ndarray, cls: np.ndarray):
+        if not tracks or len(xyxy) == 0:
+            return [], list(range(len(tracks))), list(range(len(xyxy)))
+        t_boxes = np.stack([t.box for t in tracks])
+        t_cls = np.array([t.cls for t in tracks])
+        iou = box_iou(t_boxes, xyxy) * (t_cls[:, None] == cls[None, :])
+        pairs = _greedy_match(iou, self.iou_th)
+        used_t = {i for i, _ in pairs}
+        used_d = {j for _, j in pairs}
+        return (pairs, [i for i in range(len(tracks)) if i not in used_t],
+                [j for j in range(len(xyxy)) if j not in used_d])
+
+    def _refresh(self, t: Track, box: np.ndarray, conf: float, frame: int):
+        v = (box - t.last_box) / max(frame - t.last_frame, 1)
+        t.velocity = v if t.hits == 1 else 0.5 * t.velocity + 0.5 * v
+        t.box, t.last_box, t.last_frame = box.copy(), box.copy(), frame
+        t.conf = conf
+        t.hits += 1
+        t.lost = 0
+
+    def update(self, frame: int, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray):
+        high = np.where(conf >= self.high)[0]
+        low = np.where((conf < self.high) & (conf >= self.low))[0]
+
+        pairs, rest, new = self._associate(self.tracks, xyxy[high], cls[high])
+        for ti, di in pairs:
+            self._refresh(self.tracks[ti], xyxy[high[di]], float(conf[high[di]]), frame)
+
+        remaining = [self.tracks[i] for i in rest]
+        pairs, rest, _ = self._associate(remaining, xyxy[low], cls[low])
+        for ti, di in pairs:
+            self._refresh(remaining[ti], xyxy[low[di]], float(conf[low[di]]), frame)
+        for i in rest:
+            remaining[i].lost = frame - remaining[i].last_frame
+
+        self.tracks = [t for t in self.tracks if t.lost <= self.max_lost]
+        for di in new:
+            d = high[di]
+            self.tracks.append(Track(self.next_id, xyxy[d], int(cls[d]), float(conf[d]), frame))
+            self.next_id += 1
+
+    def active(self):
+        return [t for t in self.tracks if t.lost == 0 and t.hits >= self.min_hits]
+
+
+def _detections(res):
+    boxes = res.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)
+
+
+def track_video(model, path: str, tracker: IoUTracker, keyframe_every: int = 5, batch_size: int = 4):
+    """
+    Detecta solo en 1 de cada `keyframe_every` frames (en lotes de keyframes) y propaga las pistas
+    en los intermedios. Genera (índice, frame BGR, pistas activas, es_keyframe) en orden.
+    """
+    def flush(buffer, keys):
+        results = model.predict([f for _, f in keys], conf=tracker.low, verbose=False) if keys else []
+        dets = {idx: res for (idx, _), res in zip(keys, results)}
+        for idx, frame in buffer:
+            if idx:
+                tracker.step()
+            if idx in dets:
+                tracker.update(idx, *_detections(dets[idx]))
+            yield idx, frame, tracker.active(), idx in dets
+
+    buffer, keys = [], []
+    for idx, frame in iter_video_frames(path):
+        if idx % keyframe_every == 0:
+            if len(keys) == batch_size:
+                yield from flush(buffer, keys)
+                buffer, keys = [], []
+            keys.append((idx, frame))
+        buffer.append((idx, frame))
+    yield from flush(buffer, keys)
+
+
+def draw_tracks(frame: np.ndarray, tracks, names) -> np.ndarray:
+    out = frame.copy()
+    for t in tracks:
+        x1, y1, x2, y2 = t.box.astype(int)
+        color = colors(t.id, True)
+        cv2.rectangle(out, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(out, f"#{t.id} {names.get(t.cls, str(t.cls))}", (x1, max(y1 - 6, 12)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    return out
+
+
+def _render_tracking(model_choice: str, conf_th: float, backend: str = "pytorch"):
+    uploaded = st.file_uploader("Sube un vídeo", type=VIDEO_TYPES, key="tracking_video")
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        keyframe_every = st.slider("Detectar 1 de cada N frames", 1, 15, 5,
+                                   help="Entre keyframes las cajas se propagan con el seguidor, sin ejecutar YOLO.")
+    with c2:
+        iou_th = st.slider("IoU mínimo de asociación", 0.1, 0.9, 0.3, 0.05)
+    with c3:
+        max_lost = st.slider("Frames sin ver antes de cerrar pista", 5, 120, 30)
+    if uploaded is None or not st.button("Seguir objetos", use_container_width=True):
+        return
+
+    src_path = _save_upload(uploaded)
+    out_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
+    try:
+        src_fps, total, size = _video_info(src_path)
+        model, device = load_model(model_choice, backend)
+        tracker = IoUTracker(high=conf_th, low=0.1, iou_th=iou_th, max_lost=max_lost)
+        writer = _open_video_writer(out_path, src_fps, size)
+        progress = st.progress(0.0, text=f"0/{total} frames")
+        rows, n_frames, n_keys = [], 0, 0
+        t0 = time.time()
+        try:
+            for idx, frame, tracks, is_key in track_video(model, src_path, tracker, keyframe_every):
+                n_frames += 1
+                n_keys += is_key
+                rows.extend({
+                    "frame": idx, "id": t.id, "clase": model.names.get(t.cls, str(t.cls)),
+                    "confianza": t.conf, "x1": float(t.box[0]), "y1": float(t.box[1]),
+                    "x2": float(t.box[2]), "y2": float(t.box[3]), "keyframe": is_key,
+                } for t in tracks)
+                writer.write(draw_tracks(frame, tracks, model.names))
+                if n_frames % 10 == 0:
+                    progress.progress(min(n_frames / max(total, 1), 1.0),
+                                      text=f"{n_frames}/{total} frames · {n_frames / max(time.time() - t0, 1e-6):.1f} FPS")
+        finally:
+            writer.release()
+        elapsed = time.time() - t0
+
+        if not n_frames:
+            st.error("No se pudieron leer frames del vídeo.")
+            return
+        with open(out_path, "rb") as f:
+            video_bytes = f.read()
+    except Exception as e:
+        st.error(f"Error al procesar el vídeo: {e}")
+        return
+    finally:
+        for p in (src_path, out_path):
+            if os.path.exists(p):
+                os.remove(p)
+
+    progress.empty()
+    st.success(
+        f"{n_frames} frames en {elapsed:.1f}s → {n_frames / max(elapsed, 1e-6):.1f} FPS con "
+        f"{n_keys} inferencias YOLO ({device})."
+    )
+    st.video(video_bytes)
+
+    df = pd.DataFrame(rows, columns=["frame", "id", "clase", "confianza", "x1", "y1", "x2", "y2", "keyframe"])
+    if df.empty:
+        st.info("No se siguió ningún objeto por encima del umbral.")
+        return
+    summary = df.groupby("id").agg(
+        clase=("clase", "first"), primer_frame=("frame", "min"), ultimo_frame=("frame", "max"),
+        frames=("frame", "size"), confianza_max=("confianza", "max"),
+    ).reset_index()
+    st.subheader("Conteo de objetos únicos por clase")
+    st.dataframe(summary["clase"].value_counts().rename_axis("clase").reset_index(name="objetos"),
+                 use_container_width=True)
+    st.subheader("Pistas")
+    st.dataframe(summary, use_container_width=True)
+    c1, c2 = st.columns(2)
+    with c1:
+        st.download_button("Descargar pistas por frame (CSV)", data=df.to_csv(index=False),
+                           file_name="pistas_video.csv", mime="text/csv", use_container_width=True)
+    with c2:
+        st.download_button("Descargar vídeo con IDs", data=video_bytes, file_name="seguimiento_yolo.mp4",
+                           mime="video/mp4", use_container_width=True)
+
 
 def render():
     st.title("Identificación de objetos (YOLOv8)")
 
-    col_top = st.columns([2, 1, 1])
-    with col_top[0]:
-        uploaded = st.file_uploader("Sube una imagen (JPG/PNG/WebP/BMP)", type=["jpg", "jpeg", "png", "webp", "bmp"])
+    mode = st.radio("Modo", ["Imagen", "Lote de imágenes / ZIP", "Vídeo", "Seguimiento en vídeo"], horizontal=True)
+
+    col_top = st.columns([2, 1, 1, 1])
     with col_top[1]:
         model_choice = st.selectbox(
             "Modelo",
@@ -53,6 +741,26 @@ def render():
         )
     with col_top[2]:
         conf_th = st.slider("Umbral de confianza", 0.05, 0.95, 0.25, 0.05)
+    with col_top[3]:
+        backend = BACKENDS[st.selectbox(
+            "Backend",
+            list(BACKENDS.keys()),
+            index=0,
+            help="ONNX exporta el modelo una vez y lo guarda en disco; suele ser más rápido en CPU."
+        )]
+
+    if mode.startswith("Lote"):
+        _render_image_batch(model_choice, conf_th, backend)
+        return
+    if mode == "Vídeo":
+        _render_video(model_choice, conf_th, backend)
+        return
+    if mode == "Seguimiento en vídeo":
+        _render_tracking(model_choice, conf_th, backend)
+        return
+
+    with col_top[0]:
+        uploaded = st.file_uploader("Sube una imagen (JPG/PNG/WebP/BMP)", type=["jpg", "jpeg", "png", "webp", "bmp"])
 
     detect = st.button("Detectar", use_container_width=True)
 
@@ -62,46 +770,91 @@ def render():
     image = Image.open(uploaded).convert("RGB")
     st.image(image, caption="Imagen de entrada", use_container_width=True)
 
-    if not detect:
-        return
+    with st.expander("Inferencia por teselas (imágenes muy grandes)", expanded=False):
+        tiled = st.checkbox("Activar teselado", value=False,
+                            help="Detecta a resolución nativa sobre ventanas solapadas: más recall en objetos pequeños.")
+        t1, t2, t3 = st.columns(3)
+        with t1:
+            tile = st.slider("Tamaño de tesela (px)", 320, 1280, 640, 32)
+        with t2:
+            overlap = st.slider("Solapamiento", 0.0, 0.5, 0.2, 0.05)
+        with t3:
+            tile_batch = st.slider("Teselas por lote", 1, 32, 8)
+        global_pass = st.checkbox("Añadir pasada global (objetos grandes)", value=True)
+        st.caption(f"Teselas para esta imagen: {len(make_tiles(image.height, image.width, tile, overlap))}")
 
-    with st.spinner("Cargando modelo y ejecutando inferencia..."):
-        model, device = load_model(model_choice)
-        # Ultralytics acepta arrays NumPy RGB directamente
-        img_np = np.array(image)
-        results = model.predict(img_np, conf=conf_th, verbose=False)
+    with st.expander("Comparar PyTorch vs ONNX (latencia y concordancia)", expanded=False):
+        runs = st.slider("Repeticiones", 1, 20, 5)
+        if st.button("Ejecutar comparación"):
+            with st.spinner("Exportando (si hace falta) y midiendo..."):
+                try:
+                    st.dataframe(compare_backends(model_choice, cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR),
+                                                  conf_th, runs),
+                                 use_container_width=True)
+                except Exception as e:
+                    st.error(f"Error en la comparación: {e}")
+            st.caption("Precisión/recall: coincidencia (misma clase, IoU ≥ 0.5) con las detecciones de PyTorch.")
 
-    if not results or len(results) == 0:
-        st.error("No se obtuvieron resultados del modelo.")
+    # El último resultado se conserva entre reruns: dibujar y codificar solo cuando se pide
+    params = (uploaded.name, uploaded.size, model_choice, backend, conf_th,
+              (tile, overlap, global_pass) if tiled else None)
+    if detect:
+        with st.spinner("Cargando modelo y ejecutando inferencia..."):
+            model, device = load_model(model_choice, backend)
+            # Ultralytics interpreta los arrays NumPy como BGR
+            img_bgr = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+            t0 = time.time()
+            if tiled:
+                res, n_tiles = predict_tiled(model, img_bgr, conf_th, tile, overlap, tile_batch,
+                                             global_pass=global_pass)
+            else:
+                results = model.predict(img_bgr, conf=conf_th, verbose=False)
+                if not results:
+                    st.error("No se obtuvieron resultados del modelo.")
+                    return
+                res, n_tiles = results[0], 0
+            latency = time.time() - t0
+        st.session_state["yolo_last"] = {
+            "params": params, "res": res, "df": results_to_dataframe(res),
+            "latency": latency, "device": device, "n_tiles": n_tiles, "plotted": None, "png": None,
+        }
+
+    last = st.session_state.get("yolo_last")
+    if last is None or last["params"] != params:
         return
 
-    res = results[0]
+    st.caption(
+        f"Latencia: {last['latency']:.2f}s ({last['device']})"
+        + (f" · {last['n_tiles']} teselas de {tile}px." if last["n_tiles"] else ".")
+    )
 
-    # Imagen anotada
-    plotted_bgr = res.plot()  # Devuelve BGR
-    plotted_rgb = bgr_to_rgb(plotted_bgr)
-    out_img = Image.fromarray(plotted_rgb)
+    def plotted():
+        if last["plotted"] is None:
+            last["plotted"] = last["res"].plot()  # BGR
+        return last["plotted"]
 
     st.subheader("Resultado")
-    st.image(out_img, caption="Detecciones", use_container_width=True)
+    if st.checkbox("Mostrar imagen anotada", value=True):
+        st.image(plotted(), channels="BGR", caption="Detecciones", use_container_width=True)
 
     # Tabla de detecciones
-    df = results_to_dataframe(res)
+    df = last["df"]
     st.subheader("Objetos detectados")
     if df.empty:
         st.info("Sin detecciones por encima del umbral.")
     else:
         st.dataframe(df, use_container_width=True)
 
-    # Descarga de imagen anotada
-    buf = io.BytesIO()
-    out_img.save(buf, format="PNG")
-    buf.seek(0)
-
-    st.download_button(
-        label="Descargar imagen con detecciones",
-        data=buf.getvalue(),
-        file_name="detecciones_yolo.png",
-        mime="image/png",
-        use_container_width=True
-    )
+    # Descarga de imagen anotada: el PNG se codifica solo al pedirlo. Botón en dos pasos porque con la
+    # versión mínima declarada (streamlit>=1.20) download_button exige los bytes ya generados
+    if last["png"] is None:
+        if st.button("Preparar imagen con detecciones para descargar", use_container_width=True):
+            last["png"] = encode_png(plotted())
+    if last["png"] is not None:
+        st.download_button(
+            label="Descargar imagen con detecciones",
+            data=last["png"],
+            file_name="detecciones_yolo.png",
+            mime="image/png",
+            use_container_width=True
+        )
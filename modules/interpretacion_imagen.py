@@ -28,7 +28,7 @@ except Exception:
 
 _OCR_OK = False
 try:
-    import easyocr
+    from modules.lector_ocr import load_easyocr_reader
     _OCR_OK = True
 except Exception:
     _OCR_OK = False
@@ -56,11 +56,6 @@ def _load_yolo(model_name: str = "yolov8n.pt"):
         model.to("cuda")
     return model
 
-@st.cache_resource(show_spinner=False)
-def _load_ocr():
-    # Idiomas comunes: español+inglés
-    return easyocr.Reader(["es", "en"], gpu=torch.cuda.is_available() if torch.cuda.is_available() else False)
-
 def _caption_transformers(pil_img: Image.Image, model_choice: str):
     cap_pipe = _load_caption_pipeline(model_choice)
     t0 = time.time()
@@ -97,7 +92,8 @@ def _describe_heuristic(pil_img: Image.Image, conf_th: float = 0.3):
 
     # OCR
     if _OCR_OK:
-        reader = _load_ocr()
+        # Idiomas comunes: español+inglés (lector compartido con otras páginas)
+        reader = load_easyocr_reader(("es", "en"))
         t0 = time.time()
         txts = reader.readtext(np.array(pil_img), detail=0)
         latency += time.time() - t0
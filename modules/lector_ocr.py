@@ -0,0 +1,42 @@
+import streamlit as st
+import numpy as np
+import torch
+import easyocr
+from easyocr.utils import reformat_input
+from typing import List, Sequence
+
+DEFAULT_LANGS = ("es", "en")
+
+
+@st.cache_resource(show_spinner=False)
+def load_easyocr_reader(langs: tuple = DEFAULT_LANGS):
+    """Un único lector EasyOCR por conjunto de idiomas, compartido por todas las páginas y sesiones."""
+    return easyocr.Reader(list(langs), gpu=torch.cuda.is_available())
+
+
+def readtext_batch(images: Sequence[np.ndarray], langs: tuple = DEFAULT_LANGS, batch_size: int = 16, **kwargs) -> List[list]:
+    """
+    OCR de varias imágenes en una llamada. Si todas comparten tamaño se usa readtext_batched
+    (detección en un solo lote); si no, se reconoce cada imagen con lotes de recortes de batch_size.
+    Devuelve una lista de resultados por imagen, con el mismo formato que readtext.
+    """
+    if not images:
+        return []
+    reader = load_easyocr_reader(tuple(langs))
+    if len(images) > 1 and len({img.shape for img in images}) == 1:
+        return reader.readtext_batched(list(images), batch_size=batch_size, **kwargs)
+    return [reader.readtext(img, batch_size=batch_size, **kwargs) for img in images]
+
+
+def iter_lines(reader, image: np.ndarray):
+    """
+    Detecta las cajas de texto una sola vez y reconoce caja a caja, generando cada línea
+    en cuanto se reconoce (mismo orden que readtext) para poder encadenar etapas posteriores.
+    """
+    img, img_gray = reformat_input(image)
+    horizontal, free = reader.detect(img)
+    boxes = [([box], []) for box in horizontal[0]] + [([], [box]) for box in free[0]]
+    for h_list, f_list in boxes:
+        for text in reader.recognize(img_gray, horizontal_list=h_list, free_list=f_list, detail=0):
+            if text.strip():
+                yield text.strip()
@@ -1,30 +1,503 @@
 import streamlit as st
 from PIL import Image
 import pytesseract
+import numpy as np
+import cv2
 import io
+import os
+import json
+import time
+import tempfile
+import queue
+import threading
+import zipfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+# Enlace en proceso a libtesseract (opcional; si no está se usa pytesseract)
+_TESSEROCR_OK = False
+try:
+    import tesserocr
+    _TESSEROCR_OK = True
+except Exception:
+    _TESSEROCR_OK = False
+
+# Rasterizado de PDF (opcional; si no está se extraen las imágenes embebidas con PyPDF2)
+_PDFIUM_OK = False
+try:
+    import pypdfium2 as pdfium
+    _PDFIUM_OK = True
+except Exception:
+    _PDFIUM_OK = False
+
+from PyPDF2 import PdfReader
+
+OCR_LANG = "spa+eng"
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+MULTIPAGE_EXTS = (".tif", ".tiff", ".pdf")
+PDF_DPI = 300
+ENGINES = ["tesserocr", "pytesseract"]
+
+
+# ---------------------------
+# Motores de OCR
+# ---------------------------
+# Manejadores PyTessBaseAPI ya inicializados, por idioma. Cada uno se usa por un solo hilo a la vez
+# y vuelve a la cola al terminar, así el traineddata se carga una vez por proceso y no por llamada.
+_apis = {}
+_apis_lock = threading.Lock()
+
+
+def _api_queue(lang: str) -> queue.Queue:
+    with _apis_lock:
+        return _apis.setdefault(lang, queue.Queue())
+
+
+def _borrow_api(lang: str):
+    try:
+        return _api_queue(lang).get_nowait()
+    except queue.Empty:
+        return tesserocr.PyTessBaseAPI(lang=lang)
+
+
+def image_to_text(image: Image.Image, lang: str = OCR_LANG, engine: str = "tesserocr") -> str:
+    """OCR con el motor pedido; 'tesserocr' recurre a pytesseract si el enlace no está instalado."""
+    if engine == "tesserocr" and _TESSEROCR_OK:
+        api = _borrow_api(lang)
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            _api_queue(lang).put(api)
+    return pytesseract.image_to_string(image, lang=lang)
+
+
+def benchmark_engines(image: Image.Image, lang: str = OCR_LANG, repeats: int = 5):
+    """Mide la primera llamada (incluye carga del modelo si no estaba caliente) y la media en caliente por motor."""
+    rows = []
+    for engine in ENGINES:
+        if engine == "tesserocr" and not _TESSEROCR_OK:
+            continue
+        t0 = time.time()
+        image_to_text(image, lang, engine)
+        first = time.time() - t0
+        t0 = time.time()
+        for _ in range(repeats):
+            image_to_text(image, lang, engine)
+        warm = (time.time() - t0) / repeats
+        rows.append({"motor": engine, "primera_llamada_s": round(first, 3), "media_caliente_s": round(warm, 3)})
+    return rows
+
+
+def _engine_selector() -> str:
+    engine = st.radio(
+        "Motor de OCR",
+        ENGINES,
+        index=0 if _TESSEROCR_OK else 1,
+        horizontal=True,
+        help="tesserocr mantiene Tesseract cargado en memoria; pytesseract lanza un proceso por imagen."
+    )
+    if engine == "tesserocr" and not _TESSEROCR_OK:
+        st.info("tesserocr no está instalado; se usará pytesseract.")
+    return engine
+
+
+# ---------------------------
+# Preprocesado (OpenCV)
+# ---------------------------
+PREPROCESS_STEPS = ["escalar", "grises", "binarizar", "enderezar", "recortar"]
+TARGET_DPI = 300
+MAX_SIDE = 3508  # lado largo de un A4 a 300 dpi
+
+
+def _to_gray(arr: np.ndarray) -> np.ndarray:
+    return arr if arr.ndim == 2 else cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+
+
+def _text_mask(arr: np.ndarray) -> np.ndarray:
+    """Máscara con el texto en blanco sobre negro (Otsu invertido)."""
+    gray = _to_gray(arr)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return mask
+
+
+def _step_scale(arr: np.ndarray, dpi) -> np.ndarray:
+    # Más de 300 dpi no mejora a Tesseract; sin dpi fiable (fotos de móvil) se limita el lado largo
+    scale = MAX_SIDE / max(arr.shape[:2])
+    if dpi and dpi > TARGET_DPI:
+        scale = min(scale, TARGET_DPI / dpi)
+    if scale >= 1.0:
+        return arr
+    return cv2.resize(arr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def _step_binarize(arr: np.ndarray) -> np.ndarray:
+    return cv2.adaptiveThreshold(_to_gray(arr), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+
+def _step_deskew(arr: np.ndarray) -> np.ndarray:
+    points = cv2.findNonZero(_text_mask(arr))
+    if points is None:
+        return arr
+    angle = cv2.minAreaRect(points)[-1]
+    # El ángulo de la arista es módulo 90°: llevarlo a (-45, 45]
+    if angle > 45:
+        angle -= 90
+    elif angle <= -45:
+        angle += 90
+    if abs(angle) < 0.3:
+        return arr
+    h, w = arr.shape[:2]
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    border = 255 if arr.ndim == 2 else (255, 255, 255)
+    return cv2.warpAffine(arr, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+
+def _step_crop(arr: np.ndarray, margin: int = 20) -> np.ndarray:
+    # Fundir letras en bloques y recortar a la caja que envuelve los bloques de texto
+    mask = cv2.dilate(_text_mask(arr), cv2.getStructuringElement(cv2.MORPH_RECT, (25, 7)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = 0.0005 * arr.shape[0] * arr.shape[1]
+    boxes = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) >= min_area]
+    if not boxes:
+        return arr
+    x1 = max(min(x for x, _, _, _ in boxes) - margin, 0)
+    y1 = max(min(y for _, y, _, _ in boxes) - margin, 0)
+    x2 = min(max(x + w for x, _, w, _ in boxes) + margin, arr.shape[1])
+    y2 = min(max(y + h for _, y, _, h in boxes) + margin, arr.shape[0])
+    return arr[y1:y2, x1:x2]
+
+
+def preprocess_image(image: Image.Image, steps=()):
+    """
+    Aplica las etapas pedidas (en el orden de PREPROCESS_STEPS) antes del OCR.
+    Devuelve (imagen, [{"etapa", "segundos", "pixeles"}]).
+    """
+    timings = []
+    if not steps:
+        return image, timings
+    dpi = image.info.get("dpi", (None,))[0]
+    arr = np.array(image.convert("RGB"))
+    for step in PREPROCESS_STEPS:
+        if step not in steps:
+            continue
+        t0 = time.time()
+        if step == "escalar":
+            arr = _step_scale(arr, dpi)
+        elif step == "grises":
+            arr = _to_gray(arr)
+        elif step == "binarizar":
+            arr = _step_binarize(arr)
+        elif step == "enderezar":
+            arr = _step_deskew(arr)
+        elif step == "recortar":
+            arr = _step_crop(arr)
+        timings.append({"etapa": step, "segundos": round(time.time() - t0, 4), "pixeles": int(arr.shape[0] * arr.shape[1])})
+    return Image.fromarray(arr), timings
+
+
+# ---------------------------
+# Lote (pool de procesos)
+# ---------------------------
+def init_ocr_worker(lang: str = OCR_LANG, engine: str = "pytesseract"):
+    """Inicializador de procesos que harán OCR (también lo usa la extracción del chatbot de PDF)."""
+    # Cada proceso ya es un núcleo: evitar que Tesseract abra además sus propios hilos OpenMP
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    # Dejar el motor caliente antes de la primera imagen
+    if engine == "tesserocr" and _TESSEROCR_OK:
+        _api_queue(lang).put(tesserocr.PyTessBaseAPI(lang=lang))
+
+
+def ocr_image_bytes(name: str, page, data, lang: str = OCR_LANG, engine: str = "pytesseract",
+                    steps=()) -> dict:
+    """
+    Tarea de worker: OCR de una imagen codificada (bytes) o de la página `page` de un TIFF/PDF
+    guardado en disco (ruta). Devuelve un registro serializable.
+    """
+    t0 = time.time()
+    try:
+        image = load_page(data, page) if isinstance(data, str) else Image.open(io.BytesIO(data))
+        image, _ = preprocess_image(image, steps)
+        text = image_to_text(image, lang, engine).strip()
+        error = None
+    except Exception as e:
+        text, error = "", str(e)
+    return {"archivo": name, "pagina": page, "texto": text, "segundos": round(time.time() - t0, 3), "error": error}
+
+
+# ---------------------------
+# Documentos multipágina (TIFF / PDF)
+# ---------------------------
+def count_pages(name: str, data: bytes) -> int:
+    lower = name.lower()
+    if lower.endswith(".pdf"):
+        if _PDFIUM_OK:
+            return len(pdfium.PdfDocument(data))
+        return len(PdfReader(io.BytesIO(data)).pages)
+    if lower.endswith((".tif", ".tiff")):
+        return getattr(Image.open(io.BytesIO(data)), "n_frames", 1)
+    return 1
+
+
+def render_pdf_pages(data: bytes, indices):
+    """
+    Genera (índice desde 0, imagen PIL o None) de las páginas pedidas de un PDF: rasterizadas a PDF_DPI
+    con pypdfium2 o, sin él, la mayor imagen embebida de cada página.
+    """
+    if _PDFIUM_OK:
+        pdf = pdfium.PdfDocument(data)
+        for i in indices:
+            page = pdf[i]
+            image = page.render(scale=PDF_DPI / 72).to_pil()
+            page.close()
+            yield i, image
+        return
+    pages = PdfReader(data if isinstance(data, str) else io.BytesIO(data)).pages
+    for i in indices:
+        images = list(pages[i].images)
+        yield i, Image.open(io.BytesIO(max(images, key=lambda img: len(img.data)).data)) if images else None
+
+
+def load_page(path: str, page: int) -> Image.Image:
+    """Decodifica solo la página `page` (desde 1) de un TIFF o PDF en disco; se llama dentro del worker."""
+    if path.lower().endswith(".pdf"):
+        _, image = next(render_pdf_pages(path, [page - 1]))
+        if image is None:
+            raise ValueError("la página no tiene imagen embebida (instala pypdfium2 para rasterizarla)")
+        return image
+    with Image.open(path) as tif:
+        tif.seek(page - 1)
+        return tif.copy()
+
+
+def spool_document(name: str, data: bytes, workdir: str) -> str:
+    """
+    Guarda un TIFF/PDF en `workdir` y devuelve su ruta. Las tareas llevan la ruta y no la página
+    decodificada: cada worker rasteriza la suya y el proceso principal no serializa imágenes.
+    """
+    fd, path = tempfile.mkstemp(suffix=Path(name).suffix.lower(), dir=workdir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _is_image_name(name: str) -> bool:
+    base = Path(name).name
+    return name.lower().endswith(IMAGE_EXTS + MULTIPAGE_EXTS) and not base.startswith(".") and "__MACOSX" not in name
+
+
+def _iter_files(files):
+    """Genera (nombre, bytes) de cada archivo subido o contenido en un ZIP, leyendo los miembros bajo demanda."""
+    for f in files:
+        if f.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(f.getvalue())) as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or not _is_image_name(info.filename):
+                        continue
+                    yield info.filename, zf.read(info)
+        else:
+            yield f.name, f.getvalue()
+
+
+def _count_member(name: str, read) -> int:
+    if not name.lower().endswith(MULTIPAGE_EXTS):
+        return 1
+    try:
+        return count_pages(name, read())
+    except Exception:
+        return 1
+
+
+def count_batch_inputs(files) -> int:
+    """Páginas del lote: las imágenes sueltas de un ZIP se cuentan por `infolist()`; solo se abren los TIFF/PDF."""
+    total = 0
+    for f in files:
+        if f.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(f.getvalue())) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir() and _is_image_name(info.filename):
+                        total += _count_member(info.filename, lambda: zf.read(info))
+        else:
+            total += _count_member(f.name, f.getvalue)
+    return total
+
+
+def iter_batch_inputs(files, workdir: str):
+    """
+    Genera (nombre, página, bytes o ruta) por imagen; los TIFF/PDF se guardan en `workdir` y se
+    expanden en una tarea por página que el worker decodifica.
+    """
+    for name, data in _iter_files(files):
+        try:
+            total = count_pages(name, data) if name.lower().endswith(MULTIPAGE_EXTS) else 0
+        except Exception:
+            total = 0  # ilegible: el worker lo intenta como imagen y devuelve el error
+        if total:
+            path = spool_document(name, data, workdir)
+            for page in range(1, total + 1):
+                yield name, page, path
+        else:
+            yield name, None, data
+
+
+def run_batch(items, workers: int, lang: str = OCR_LANG, engine: str = "pytesseract", steps=()):
+    """
+    OCR de (nombre, página, bytes o ruta) en un pool de procesos. Como mucho 2×workers tareas en vuelo,
+    así la memoria no crece con el tamaño del lote. Genera los registros según terminan.
+    """
+    max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_worker, initargs=(lang, engine)) as ex:
+        pending = set()
+        for name, page, data in items:
+            pending.add(ex.submit(ocr_image_bytes, name, page, data, lang, engine, tuple(steps)))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+        for fut in as_completed(pending):
+            yield fut.result()
+
+
+def _record_title(r: dict) -> str:
+    return r["archivo"] if r["pagina"] is None else f"{r['archivo']} — página {r['pagina']}"
+
+
+def _records_to_txt(records) -> str:
+    return "\n\n".join(f"===== {_record_title(r)} =====\n{r['texto']}" for r in records)
+
+
+def _records_to_jsonl(records) -> str:
+    return "\n".join(json.dumps(r, ensure_ascii=False) for r in records)
+
+
+def _render_batch(engine: str, steps):
+    files = st.file_uploader(
+        "Sube imágenes, TIFF/PDF multipágina o archivos ZIP con ellos",
+        type=["jpg", "jpeg", "png", "tif", "tiff", "bmp", "pdf", "zip"],
+        accept_multiple_files=True
+    )
+    cpu = os.cpu_count() or 1
+    workers = st.slider("Procesos de OCR", 1, cpu, cpu)
+
+    if not files or not st.button("Procesar lote"):
+        return
+
+    total = count_batch_inputs(files)
+    if total == 0:
+        st.warning("No se encontraron imágenes en los archivos subidos.")
+        return
+
+    progress = st.progress(0.0, text=f"0/{total} páginas")
+    table = st.empty()
+    last_text = st.empty()
+    records = []
+    t0 = time.time()
+    with tempfile.TemporaryDirectory() as workdir:
+        for rec in run_batch(iter_batch_inputs(files, workdir), workers, engine=engine, steps=steps):
+            records.append(rec)
+            elapsed = time.time() - t0
+            progress.progress(
+                min(len(records) / total, 1.0),
+                text=f"{len(records)}/{total} páginas · {len(records) / max(elapsed, 1e-6):.1f} pág/s"
+            )
+            table.dataframe(
+                [{"archivo": r["archivo"], "página": r["pagina"], "caracteres": len(r["texto"]),
+                  "segundos": r["segundos"], "error": r["error"]}
+                 for r in records[-20:]],
+                use_container_width=True
+            )
+            last_text.text(rec["texto"][:2000])
+
+    errors = sum(1 for r in records if r["error"])
+    st.success(f"Lote completado: {len(records)} páginas en {time.time() - t0:.1f}s ({errors} con error).")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Descargar TXT", data=_records_to_txt(records), file_name="ocr_lote.txt", mime="text/plain")
+    with col2:
+        st.download_button("Descargar JSONL", data=_records_to_jsonl(records), file_name="ocr_lote.jsonl", mime="application/json")
+
+
+def _render_pages(name: str, data: bytes, engine: str, steps):
+    """OCR página a página en paralelo; el texto aparece en orden de página conforme terminan."""
+    try:
+        total = count_pages(name, data)
+    except Exception as e:
+        st.error(f"No se pudo abrir el documento: {e}")
+        return
+    st.caption(f"Documento multipágina: {total} páginas.")
+
+    if not st.button("Procesar documento"):
+        return
+
+    workers = min(os.cpu_count() or 1, max(total, 1))
+    progress = st.progress(0.0, text=f"0/{total} páginas")
+    partial = st.empty()
+    done = {}
+    t0 = time.time()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = spool_document(name, data, workdir)
+        items = ((name, page, path) for page in range(1, total + 1))
+        for rec in run_batch(items, workers, engine=engine, steps=steps):
+            done[rec["pagina"]] = rec
+            progress.progress(min(len(done) / max(total, 1), 1.0), text=f"{len(done)}/{total} páginas")
+            partial.text(_records_to_txt([done[p] for p in sorted(done)]))
+
+    records = [done[p] for p in sorted(done)]
+    errors = [r for r in records if r["error"]]
+    st.success(f"OCR completado: {len(records)} páginas en {time.time() - t0:.1f}s.")
+    for r in errors:
+        st.warning(f"Página {r['pagina']}: {r['error']}")
+    st.download_button("Descargar texto", data=_records_to_txt(records), file_name="ocr_resultado.txt", mime="text/plain")
+
 
 def render():
     st.title("OCR (Imagen → Texto)")
     st.markdown("Extrae texto de imágenes usando **Tesseract OCR**.")
 
+    mode = st.radio("Modo", ["Imagen única", "Lote (varias imágenes / ZIP)"], horizontal=True)
+    engine = _engine_selector()
+    steps = st.multiselect(
+        "Preprocesado antes del OCR (opcional)",
+        PREPROCESS_STEPS,
+        default=[],
+        help="Reduce píxeles y ruido antes de Tesseract: escalado según DPI, grises, binarización adaptativa, "
+             "corrección de inclinación y recorte a la zona de texto."
+    )
+    if mode.startswith("Lote"):
+        _render_batch(engine, steps)
+        return
+
     uploaded_file = st.file_uploader(
-        "Sube una imagen (JPG, PNG, TIFF, BMP)",
-        type=["jpg", "jpeg", "png", "tiff", "bmp"]
+        "Sube una imagen (JPG, PNG, TIFF, BMP) o un PDF",
+        type=["jpg", "jpeg", "png", "tif", "tiff", "bmp", "pdf"]
     )
 
     if uploaded_file:
+        data = uploaded_file.getvalue()
+        if uploaded_file.name.lower().endswith(".pdf"):
+            _render_pages(uploaded_file.name, data, engine, steps)
+            return
         try:
-            image = Image.open(io.BytesIO(uploaded_file.read()))
+            image = Image.open(io.BytesIO(data))
         except Exception as e:
             st.error(f"No se pudo abrir la imagen: {e}")
             return
 
+        if getattr(image, "n_frames", 1) > 1:
+            st.image(image, caption="Primera página", use_container_width=True)
+            _render_pages(uploaded_file.name, data, engine, steps)
+            return
+
         st.image(image, caption="Imagen cargada", use_container_width=True)
 
         if st.button("Procesar imagen"):
             with st.spinner("Extrayendo texto..."):
                 try:
-                    text = pytesseract.image_to_string(image, lang="spa+eng")
+                    prepared, timings = preprocess_image(image, steps)
+                    t0 = time.time()
+                    text = image_to_text(prepared, OCR_LANG, engine)
+                    latency = time.time() - t0
                 except Exception as e:
                     st.error(f"Error al aplicar OCR: {e}")
                     return
@@ -32,6 +505,14 @@ def render():
             st.success("OCR completado")
             st.markdown("#### Texto detectado")
             st.text_area("Resultado OCR", text.strip(), height=250)
+            st.caption(f"Motor: {engine}. Latencia de reconocimiento: {latency:.2f}s.")
+            if timings:
+                st.markdown("#### Preprocesado")
+                st.dataframe(
+                    [{"etapa": "original", "segundos": 0.0, "pixeles": image.width * image.height}] + timings,
+                    use_container_width=True
+                )
+                st.image(prepared, caption="Imagen preprocesada", use_container_width=True)
 
             st.download_button(
                 "Descargar texto",
@@ -39,3 +520,43 @@ def render():
                 file_name="ocr_resultado.txt",
                 mime="text/plain"
             )
+
+        with st.expander("Comparar con y sin preprocesado", expanded=False):
+            if not steps:
+                st.info("Selecciona al menos una etapa de preprocesado.")
+            elif st.button("Comparar preprocesado"):
+                with st.spinner("Comparando..."):
+                    try:
+                        rows, texts = [], {}
+                        for label, use_steps in (("sin preprocesado", ()), ("con preprocesado", steps)):
+                            t0 = time.time()
+                            prepared, _ = preprocess_image(image, use_steps)
+                            t1 = time.time()
+                            texts[label] = image_to_text(prepared, OCR_LANG, engine).strip()
+                            t2 = time.time()
+                            rows.append({
+                                "variante": label, "pixeles": prepared.width * prepared.height,
+                                "preprocesado_s": round(t1 - t0, 3), "ocr_s": round(t2 - t1, 3),
+                                "caracteres": len(texts[label]),
+                            })
+                    except Exception as e:
+                        st.error(f"Error en la comparación: {e}")
+                        return
+                st.dataframe(rows, use_container_width=True)
+                c1, c2 = st.columns(2)
+                for col, label in zip((c1, c2), texts):
+                    with col:
+                        st.text_area(label.capitalize(), texts[label], height=200)
+
+        with st.expander("Comparar motores (tesserocr vs pytesseract)", expanded=False):
+            repeats = st.slider("Repeticiones", 1, 20, 5)
+            if st.button("Ejecutar benchmark"):
+                with st.spinner("Midiendo..."):
+                    try:
+                        rows = benchmark_engines(image, OCR_LANG, repeats)
+                    except Exception as e:
+                        st.error(f"Error en el benchmark: {e}")
+                        return
+                st.dataframe(rows, use_container_width=True)
+                if not _TESSEROCR_OK:
+                    st.info("Instala tesserocr para comparar con el motor en proceso.")
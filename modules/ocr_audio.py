@@ -1,17 +1,248 @@
 import streamlit as st
 from PIL import Image
 import numpy as np
-import easyocr
 from googletrans import Translator
-from gtts import gTTS
-import tempfile
+import asyncio
+import inspect
+import queue
+import threading
+import time
 import uuid
+from typing import List
+
+from modules.cache_disco import CACHE_ROOT, DiskLRUCache, make_key
+from modules.lector_ocr import iter_lines, load_easyocr_reader, readtext_batch
+from modules.sintesis import audio_cache, join_audio, synthesize, synthesize_cached
+
+
+# ---------------------------
+# Traducción con caché
+# ---------------------------
+class GoogleTranslatorBackend:
+    name = "google"
+
+    async def _translate_batch(self, texts: List[str], src: str, dest: str) -> List[str]:
+        translator = Translator()
+
+        async def translate(text: str) -> str:
+            result = translator.translate(text, src=src, dest=dest)
+            # googletrans >= 4.0.2 expone una API asíncrona
+            if inspect.isawaitable(result):
+                result = await result
+            return result.text
+
+        lines = (await translate("\n".join(texts))).split("\n")
+        if len(lines) == len(texts):
+            return [ln.strip() for ln in lines]
+        return [await translate(t) for t in texts]
+
+    def translate_batch(self, texts: List[str], src: str, dest: str) -> List[str]:
+        """
+        Un solo request por lote: con una lista googletrans hace un request por elemento, así que los
+        segmentos (líneas sin salto) se unen en un texto y se separan de vuelta por línea. Si el número
+        de líneas no cuadra, se traduce segmento a segmento con el mismo Translator.
+        """
+        return asyncio.run(self._translate_batch(texts, src, dest))
+
+
+class LocalTranslatorBackend:
+    """Traductor local de pruebas (sin red): marca cada segmento con el idioma destino."""
+    name = "local"
+
+    def translate_batch(self, texts: List[str], src: str, dest: str) -> List[str]:
+        return [f"[{dest}] {t}" for t in texts]
+
+
+TRANSLATORS = {
+    "Google (googletrans)": GoogleTranslatorBackend,
+    "Local (sin red, pruebas)": LocalTranslatorBackend,
+}
+
+
+@st.cache_resource(show_spinner=False)
+def _translation_cache():
+    return DiskLRUCache(CACHE_ROOT / "traducciones", max_bytes=32 * 1024 * 1024)
+
+
+class CachedTranslator:
+    """
+    Traduce por segmentos (líneas). Cada (segmento, origen, destino, motor) se guarda en disco;
+    solo los segmentos nuevos se envían al motor, agrupados en lotes de como mucho max_chars.
+    """
+
+    def __init__(self, backend, cache: DiskLRUCache, max_chars: int = 4500):
+        self.backend = backend
+        self.cache = cache
+        self.max_chars = max_chars
+
+    def _key(self, segment: str, src: str, dest: str) -> str:
+        return make_key(segment, src, dest, self.backend.name)
+
+    def _batches(self, segments: List[str]):
+        batch, size = [], 0
+        for seg in segments:
+            if batch and size + len(seg) + 1 > self.max_chars:
+                yield batch
+                batch, size = [], 0
+            batch.append(seg)
+            size += len(seg) + 1  # + el "\n" que los separa en el request
+        if batch:
+            yield batch
+
+    def translate_segments(self, segments: List[str], dest: str, src: str = "auto") -> List[str]:
+        found = {}
+        for seg in dict.fromkeys(segments):
+            cached = self.cache.get(self._key(seg, src, dest))
+            if cached is not None:
+                found[seg] = cached.decode("utf-8")
+        missing = [seg for seg in dict.fromkeys(segments) if seg not in found]
+        for batch in self._batches(missing):
+            for seg, translated in zip(batch, self.backend.translate_batch(batch, src, dest)):
+                found[seg] = translated
+                self.cache.set(self._key(seg, src, dest), translated.encode("utf-8"))
+        return [found[seg] for seg in segments]
+
+    def translate(self, text: str, dest: str, src: str = "auto") -> str:
+        lines = text.splitlines()
+        segments = [ln.strip() for ln in lines if ln.strip()]
+        translated = iter(self.translate_segments(segments, dest, src))
+        return "\n".join(next(translated) if ln.strip() else "" for ln in lines)
+
+
+# ---------------------------
+# Ejecución en cadena (OCR → traducción → audio)
+# ---------------------------
+_DONE = object()
+
+
+def _drain(q: queue.Queue, first, limit: int):
+    """Junta first con lo que ya esté esperando en la cola (sin bloquear), hasta limit elementos."""
+    items = [first]
+    while len(items) < limit:
+        try:
+            item = q.get_nowait()
+        except queue.Empty:
+            break
+        if item is _DONE:
+            q.put(_DONE)
+            break
+        items.append(item)
+    return items
+
+
+def run_pipeline(reader, images, translator: CachedTranslator, dest: str, tts_cache, batch_limit: int = 8):
+    """
+    Tres etapas en hilos propios unidas por colas: cada línea reconocida pasa a traducción
+    (en micro-lotes con lo que haya pendiente) y luego a síntesis, sin esperar al resto del texto.
+    Genera eventos ("ocr" | "audio" | "error", datos) en el hilo que llama, que es el único que pinta.
+    """
+    ocr_q, tts_q, out_q = queue.Queue(), queue.Queue(), queue.Queue()
+
+    def _stage(fn, out):
+        def run():
+            try:
+                fn()
+            except Exception as e:
+                out_q.put(("error", e))
+            finally:
+                out.put(_DONE)
+        return run
+
+    def ocr_stage():
+        idx = 0
+        for img in images:
+            for line in iter_lines(reader, img):
+                ocr_q.put((idx, line))
+                out_q.put(("ocr", (idx, line)))
+                idx += 1
+
+    def translate_stage():
+        while True:
+            item = ocr_q.get()
+            if item is _DONE:
+                return
+            batch = _drain(ocr_q, item, batch_limit)
+            translated = translator.translate_segments([line for _, line in batch], dest)
+            for (idx, line), tr in zip(batch, translated):
+                tts_q.put((idx, line, tr))
+
+    def tts_stage():
+        while True:
+            item = tts_q.get()
+            if item is _DONE:
+                return
+            idx, line, tr = item
+            out_q.put(("audio", (idx, line, tr, synthesize_cached(tr, dest, cache=tts_cache))))
+
+    threads = [
+        threading.Thread(target=_stage(ocr_stage, ocr_q), daemon=True),
+        threading.Thread(target=_stage(translate_stage, tts_q), daemon=True),
+        threading.Thread(target=_stage(tts_stage, out_q), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+    while True:
+        event = out_q.get()
+        if event is _DONE:
+            break
+        yield event
+
+
+def _render_pipeline(images, translator: CachedTranslator, target_lang: str):
+    reader = load_easyocr_reader(("es", "en"))
+    st.markdown("### Texto detectado")
+    ocr_box = st.empty()
+    st.markdown("### Traducción y audio por línea")
+    status = st.empty()
+
+    lines, segments = [], {}
+    t0 = time.time()
+    first_audio = None
+    tts_cache = audio_cache()
+    for kind, data in run_pipeline(reader, [np.array(img) for img in images], translator, target_lang, tts_cache):
+        if kind == "error":
+            st.error(f"Error en la cadena: {data}")
+            continue
+        if kind == "ocr":
+            lines.append(data[1])
+            ocr_box.text("\n".join(lines))
+        else:
+            idx, line, tr, mp3 = data
+            segments[idx] = (tr, mp3)
+            if first_audio is None:
+                first_audio = time.time() - t0
+            st.markdown(f"**{idx + 1}.** {tr}")
+            st.audio(mp3, format="audio/mp3")
+        status.caption(f"Líneas reconocidas: {len(lines)} · con audio: {len(segments)}")
+
+    if not segments:
+        st.warning("No se detectó texto en la imagen.")
+        return
+
+    ordered = [segments[i] for i in sorted(segments)]
+    translated = "\n".join(tr for tr, _ in ordered)
+    audio_bytes = join_audio([mp3 for _, mp3 in ordered], "mp3")
+    st.success(
+        f"Completado en {time.time() - t0:.1f}s. Primer audio disponible a los {first_audio:.1f}s."
+    )
+    st.caption(f"Caché de audio: {tts_cache.stats_text()}.")
+    st.text_area("Texto traducido", translated, height=200)
+    st.audio(audio_bytes, format="audio/mp3")
+    st.download_button(
+        "Descargar audio",
+        data=audio_bytes,
+        file_name=f"ocr_traduccion_{uuid.uuid4().hex[:8]}.mp3",
+        mime="audio/mpeg"
+    )
+
 
 def render():
     st.title("OCR → Traducción → Audio")
     st.markdown("Extrae texto de imágenes, tradúcelo y genera audio en el idioma seleccionado.")
 
-    uploaded_file = st.file_uploader("Sube una imagen (JPG o PNG)", type=["jpg", "jpeg", "png"])
+    uploaded_files = st.file_uploader(
+        "Sube una o varias imágenes (JPG o PNG)", type=["jpg", "jpeg", "png"], accept_multiple_files=True
+    )
 
     target_lang = st.selectbox(
         "Idioma destino",
@@ -20,15 +251,27 @@ def render():
         format_func=lambda x: x[1]
     )[0]
 
-    if uploaded_file is not None:
-        image = Image.open(uploaded_file)
-        st.image(image, caption="Imagen cargada", use_container_width=True)
+    translator_label = st.selectbox("Traductor", list(TRANSLATORS.keys()), index=0)
+    streaming = st.checkbox(
+        "Procesar en cadena (audio por línea según se reconoce)",
+        value=True,
+        help="OCR, traducción y síntesis se solapan en hilos: el primer audio está listo antes de terminar el OCR."
+    )
+
+    if uploaded_files:
+        images = [Image.open(f).convert("RGB") for f in uploaded_files]
+        st.image(images, caption=[f.name for f in uploaded_files], use_container_width=True)
 
         if st.button("Procesar"):
+            if streaming:
+                cache = _translation_cache()
+                _render_pipeline(images, CachedTranslator(TRANSLATORS[translator_label](), cache), target_lang)
+                st.caption(f"Caché de traducciones: {cache.stats_text()}.")
+                return
+
             with st.spinner("Ejecutando OCR..."):
-                reader = easyocr.Reader(['es', 'en'])
-                result = reader.readtext(np.array(image), detail=0)
-                extracted_text = "\n".join(result).strip()
+                results = readtext_batch([np.array(img) for img in images], ("es", "en"), detail=0)
+                extracted_text = "\n".join(line for result in results for line in result).strip()
 
             if not extracted_text:
                 st.warning("No se detectó texto en la imagen.")
@@ -38,21 +281,23 @@ def render():
             st.text_area("Texto OCR", extracted_text, height=200)
 
             with st.spinner("Traduciendo texto..."):
-                translator = Translator()
-                translated = translator.translate(extracted_text, dest=target_lang).text
+                cache = _translation_cache()
+                translator = CachedTranslator(TRANSLATORS[translator_label](), cache)
+                try:
+                    translated = translator.translate(extracted_text, dest=target_lang)
+                except Exception as e:
+                    st.error(f"Error al traducir: {e}")
+                    return
 
             st.markdown("### Traducción")
             st.text_area("Texto traducido", translated, height=200)
+            st.caption(f"Caché de traducciones: {cache.stats_text()}.")
 
             with st.spinner("Generando audio..."):
-                tts = gTTS(text=translated, lang=target_lang)
-                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-                tts.save(tmp.name)
-
-            with open(tmp.name, "rb") as f:
-                audio_bytes = f.read()
+                audio_bytes = synthesize(translated, target_lang)
 
             st.audio(audio_bytes, format="audio/mp3")
+            st.caption(f"Caché de audio: {audio_cache().stats_text()}.")
 
             st.download_button(
                 "Descargar audio",
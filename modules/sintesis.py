@@ -0,0 +1,164 @@
+import streamlit as st
+from gtts import gTTS
+import io
+import re
+import shutil
+import subprocess
+import time
+import wave
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
+from modules.cache_disco import CACHE_ROOT, DiskLRUCache, make_key
+
+
+@st.cache_resource(show_spinner=False)
+def audio_cache() -> DiskLRUCache:
+    """Caché de audio sintetizado compartida por las páginas de Texto → Audio y OCR → Audio."""
+    return DiskLRUCache(CACHE_ROOT / "audio_tts", max_bytes=128 * 1024 * 1024)
+
+
+def split_sentences(text: str) -> List[str]:
+    raw = re.split(r"(?<=[\.\?\!…])\s+|\n+", text)
+    return [re.sub(r"\s+", " ", s).strip() for s in raw if s and s.strip()]
+
+
+# ---------------------------
+# Motores de voz
+# ---------------------------
+class TTSBackend(ABC):
+    """Interfaz de un motor de síntesis: texto → bytes de audio en audio_format."""
+    name = ""
+    label = ""
+    audio_format = "mp3"
+    mime = "audio/mpeg"
+
+    def available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        ...
+
+
+class GTTSBackend(TTSBackend):
+    name = "gtts"
+    label = "gTTS (Google, requiere red)"
+
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        buf = io.BytesIO()
+        gTTS(text=text, lang=lang, slow=slow).write_to_fp(buf)
+        return buf.getvalue()
+
+
+class EspeakBackend(TTSBackend):
+    """Sintetizador de formantes eSpeak NG: local, sin red y muy rápido en CPU."""
+    name = "espeak"
+    label = "eSpeak NG (local, sin red)"
+    audio_format = "wav"
+    mime = "audio/wav"
+
+    def __init__(self):
+        self.binary = shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def available(self) -> bool:
+        return self.binary is not None
+
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        # Texto por stdin: evita que un fragmento que empiece por '-' se lea como opción
+        proc = subprocess.run(
+            [self.binary, "-v", lang, "-s", "120" if slow else "170", "--stdout", "--stdin"],
+            input=text.encode("utf-8"), capture_output=True, check=True
+        )
+        return proc.stdout
+
+
+BACKENDS = {b.name: b for b in (GTTSBackend(), EspeakBackend())}
+
+
+# ---------------------------
+# Síntesis con caché
+# ---------------------------
+def synthesize_cached(text: str, lang: str, slow: bool = False, cache: DiskLRUCache = None,
+                      backend: TTSBackend = None) -> bytes:
+    """Audio de un fragmento; clave SHA-256 de (motor, texto, idioma, lento)."""
+    cache = cache or audio_cache()
+    backend = backend or BACKENDS["gtts"]
+    key = make_key(backend.name, text, lang, slow)
+    data = cache.get(key)
+    if data is None:
+        data = backend.synthesize(text, lang, slow)
+        cache.set(key, data)
+    return data
+
+
+def join_audio(parts: List[bytes], audio_format: str = "mp3") -> bytes:
+    """Unión sin recodificar: tramas MP3 concatenadas, o WAV reescrito con una sola cabecera."""
+    if audio_format != "wav":
+        # gTTS produce tramas MP3 independientes, así que concatenarlas da un MP3 válido
+        return b"".join(parts)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as dst:
+        for i, data in enumerate(parts):
+            with wave.open(io.BytesIO(data), "rb") as src:
+                if i == 0:
+                    dst.setparams(src.getparams())
+                dst.writeframes(src.readframes(src.getnframes()))
+    return out.getvalue()
+
+
+def synthesize(text: str, lang: str, slow: bool = False, cache: DiskLRUCache = None,
+               backend: TTSBackend = None) -> bytes:
+    """
+    Sintetiza oración a oración a través de la caché: al editar un párrafo solo se regeneran sus
+    oraciones.
+    """
+    cache = cache or audio_cache()
+    backend = backend or BACKENDS["gtts"]
+    parts = [synthesize_cached(s, lang, slow, cache, backend) for s in split_sentences(text)]
+    return join_audio(parts, backend.audio_format)
+
+
+def synthesize_parallel(text: str, lang: str, slow: bool = False, workers: int = 4, cache: DiskLRUCache = None,
+                        backend: TTSBackend = None):
+    """
+    Sintetiza las oraciones en un pool acotado de hilos (vía la caché).
+    Genera (índice, total, audio) según terminan, no en orden.
+    """
+    cache = cache or audio_cache()
+    sentences = split_sentences(text)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = {
+            ex.submit(synthesize_cached, s, lang, slow, cache, backend): i for i, s in enumerate(sentences)
+        }
+        for fut in as_completed(futures):
+            yield futures[fut], len(sentences), fut.result()
+
+
+def benchmark_backends(text: str, lang: str, backends=None):
+    """
+    Caracteres por segundo de cada motor disponible, sintetizando sin caché oración a oración.
+    Un motor que falla (p. ej. gTTS sin red) deja su error en su fila y no impide medir los demás.
+    """
+    rows = []
+    sentences = split_sentences(text)
+    chars = sum(len(s) for s in sentences)
+    for backend in backends or BACKENDS.values():
+        if not backend.available():
+            continue
+        t0 = time.time()
+        try:
+            size, error = sum(len(backend.synthesize(s, lang)) for s in sentences), ""
+        except Exception as e:
+            size, error = None, str(e)
+        elapsed = time.time() - t0
+        rows.append({
+            "motor": backend.label,
+            "caracteres": chars,
+            "segundos": round(elapsed, 3),
+            "caracteres_por_s": round(chars / max(elapsed, 1e-6), 1) if not error else None,
+            "bytes_audio": size,
+            "error": error,
+        })
+    return rows
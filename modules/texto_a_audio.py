@@ -1,11 +1,34 @@
 import streamlit as st
-from gtts import gTTS
-import io
 import uuid
 
+from modules.sintesis import BACKENDS, audio_cache, benchmark_backends, join_audio, synthesize_parallel
+
+BENCHMARK_TEXT = (
+    "La síntesis de voz convierte texto escrito en audio. "
+    "Este párrafo sirve para comparar la velocidad de cada motor. "
+    "Cuantos más caracteres por segundo, menor es la espera del usuario."
+)
+
+
+def _render_benchmark(text: str, lang_code: str):
+    with st.expander("Comparar motores (caracteres por segundo)", expanded=False):
+        sample = st.text_area("Texto de prueba", text.strip() or BENCHMARK_TEXT, height=100)
+        if st.button("Ejecutar benchmark"):
+            with st.spinner("Midiendo motores (sin caché)..."):
+                try:
+                    rows = benchmark_backends(sample, lang_code)
+                except Exception as e:
+                    st.error(f"Error en el benchmark: {e}")
+                    return
+            st.dataframe(rows, use_container_width=True)
+            missing = [b.label for b in BACKENDS.values() if not b.available()]
+            if missing:
+                st.info(f"No disponibles en este entorno: {', '.join(missing)}.")
+
+
 def render():
-    st.title("Texto → Audio (gTTS)")
-    st.markdown("Convierte texto en audio reproducible (MP3).")
+    st.title("Texto → Audio")
+    st.markdown("Convierte texto en audio reproducible (MP3 con gTTS o WAV con un motor local).")
 
     LANGUAGES = {
         "Español (es)": "es",
@@ -20,33 +43,65 @@ def render():
     with st.form(key="tts_form"):
         text = st.text_area("Texto a convertir", height=200)
         lang_label = st.selectbox("Idioma", list(LANGUAGES.keys()), index=0)
+        backend_name = st.selectbox(
+            "Motor de voz",
+            list(BACKENDS.keys()),
+            format_func=lambda n: BACKENDS[n].label if BACKENDS[n].available() else f"{BACKENDS[n].label} — no instalado",
+            help="gTTS necesita conexión; eSpeak NG funciona sin red."
+        )
         slow = st.checkbox("Velocidad lenta", value=False)
+        workers = st.slider(
+            "Hilos de síntesis", 1, 8, 4,
+            help="Los textos largos se dividen en oraciones que se sintetizan en paralelo."
+        )
         filename_input = st.text_input("Nombre de archivo (sin extensión)", value="audio")
         submit = st.form_submit_button("Generar audio")
 
+    lang_code = LANGUAGES[lang_label]
+    backend = BACKENDS[backend_name]
+
     if submit:
         if not text.strip():
             st.error("El texto está vacío.")
             return
+        if not backend.available():
+            st.error(f"El motor '{backend.label}' no está disponible en este entorno.")
+            return
 
-        lang_code = LANGUAGES[lang_label]
+        progress = st.progress(0.0, text="Generando audio...")
+        first_part = st.empty()
+        parts = {}
         try:
-            tts = gTTS(text=text.strip(), lang=lang_code, slow=slow)
-            mp3_fp = io.BytesIO()
-            tts.write_to_fp(mp3_fp)
-            mp3_fp.seek(0)
+            for i, total, audio in synthesize_parallel(text.strip(), lang_code, slow, workers, backend=backend):
+                parts[i] = audio
+                progress.progress(len(parts) / total, text=f"{len(parts)}/{total} oraciones")
+                if i == 0 and total > 1:
+                    # Primera oración reproducible mientras se generan las demás
+                    first_part.audio(audio, format=backend.mime)
         except Exception as e:
             st.error(f"Error al generar audio: {e}")
             return
 
-        st.audio(mp3_fp.getvalue())
+        if not parts:
+            st.error("No se pudo generar audio para el texto.")
+            return
+
+        with st.spinner("Uniendo fragmentos..."):
+            audio_bytes = join_audio([parts[i] for i in sorted(parts)], backend.audio_format)
+        first_part.empty()
+        progress.empty()
+
+        st.audio(audio_bytes, format=backend.mime)
+        st.caption(f"Caché de audio: {audio_cache().stats_text()}.")
 
         safe_name = filename_input.strip() if filename_input.strip() else "audio"
-        unique_name = f"{safe_name}_{uuid.uuid4().hex[:8]}.mp3"
+        unique_name = f"{safe_name}_{uuid.uuid4().hex[:8]}.{backend.audio_format}"
 
         st.download_button(
-            label="Descargar MP3",
-            data=mp3_fp.getvalue(),
+            label=f"Descargar {backend.audio_format.upper()}",
+            data=audio_bytes,
             file_name=unique_name,
-            mime="audio/mpeg",
+            mime=backend.mime,
         )
+
+    _render_benchmark(text, lang_code)
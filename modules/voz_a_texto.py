@@ -1,41 +1,579 @@
 import streamlit as st
 from pathlib import Path
 import whisper
+import librosa
+import numpy as np
+import pandas as pd
+import torch
+import re
 import tempfile
+import io
+import threading
+import queue
+import copy
+import time
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from modules.cache_disco import CACHE_ROOT, DiskLRUCache, make_key
+
+# Micrófono en tiempo real (opcional)
+try:
+    from streamlit_webrtc import webrtc_streamer, WebRtcMode
+    WEBRTC_OK = True
+except Exception:
+    WEBRTC_OK = False
+
+WHISPER_SIZES = ["tiny", "base", "small", "medium"]
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+VAD_TOP_DB = 35.0
+SEGMENT_SECONDS = 30.0
+
+
+def quantize_whisper(model):
+    """Cuantización dinámica int8 (torch) de las capas lineales de Whisper, in situ. Solo CPU."""
+    # whisper.model.Linear es una subclase de nn.Linear que quantize_dynamic no reconoce;
+    # en CPU y float32 su forward es idéntico, así que se reetiquetan como nn.Linear.
+    for m in model.modules():
+        if isinstance(m, torch.nn.Linear):
+            m.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+@st.cache_resource(show_spinner=False)
+def load_whisper(size: str, quantized: bool = False):
+    """Carga cada variante (tamaño, int8) de Whisper una sola vez por proceso (compartida entre sesiones)."""
+    t0 = time.time()
+    if quantized:
+        model = quantize_whisper(whisper.load_model(size, device="cpu"))
+    else:
+        model = whisper.load_model(size)
+    load_time = time.time() - t0
+    # transcribe() instala hooks de kv-cache sobre el propio modelo,
+    # así que dos sesiones no pueden decodificar con él a la vez.
+    lock = threading.Lock()
+    return model, lock, load_time
+
+
+def transcribe(size: str, audio, quantized: bool = False, **options):
+    """Transcribe con el modelo compartido. Devuelve (resultado, t_carga, t_inferencia)."""
+    t0 = time.time()
+    model, lock, _ = load_whisper(size, quantized)
+    load_time = time.time() - t0
+    options.setdefault("fp16", model.device.type == "cuda")
+    with lock:
+        t1 = time.time()
+        result = model.transcribe(audio, **options)
+        infer_time = time.time() - t1
+    return result, load_time, infer_time
+
+
+@st.cache_resource(show_spinner=False)
+def _transcript_cache():
+    return DiskLRUCache(CACHE_ROOT / "transcripciones", max_bytes=64 * 1024 * 1024)
+
+
+def transcript_key(audio_digest: str, size: str, long_mode: bool, **options) -> str:
+    """Clave por contenido del audio + modelo + opciones de decodificación."""
+    if long_mode:
+        options.update(modo="largo", top_db=VAD_TOP_DB, max_seconds=SEGMENT_SECONDS)
+    return make_key(audio_digest, size, json.dumps(options, sort_keys=True))
+
+
+# ---------------------------
+# Ingesta de audio en memoria
+# ---------------------------
+def decode_audio(data: bytes, suffix: str = "") -> np.ndarray:
+    """Decodifica los bytes subidos a mono float32 a 16 kHz (la entrada que espera Whisper)."""
+    try:
+        y, _ = librosa.load(io.BytesIO(data), sr=SAMPLE_RATE, mono=True)
+    except Exception:
+        # Formatos que libsndfile no lee (p. ej. m4a): ffmpeg vía Whisper, una sola vez por archivo
+        with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+            tmp.write(data)
+            tmp.flush()
+            y = whisper.load_audio(tmp.name)
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+def session_audio(uploaded, digest: str) -> np.ndarray:
+    """Forma de onda del archivo subido; solo se decodifica la primera vez en la sesión."""
+    cached = st.session_state.get("voz_audio")
+    if cached is None or cached[0] != digest:
+        with st.spinner("Decodificando audio..."):
+            cached = (digest, decode_audio(uploaded.getvalue(), Path(uploaded.name).suffix))
+        st.session_state["voz_audio"] = cached
+    return cached[1]
+
+
+# ---------------------------
+# Modo audio largo
+# ---------------------------
+@st.cache_resource(show_spinner=False)
+def _replica_pool(size: str, quantized: bool):
+    return {"queue": queue.Queue(), "count": 0, "active": 0, "lock": threading.Lock()}
+
+
+def acquire_whisper_replicas(size: str, n: int, quantized: bool = False) -> queue.Queue:
+    """
+    Cola compartida con al menos n copias del modelo para decodificar segmentos en paralelo.
+    Cada llamada se empareja con release_whisper_replicas al terminar.
+    """
+    pool = _replica_pool(size, quantized)
+    with pool["lock"]:
+        pool["active"] += 1
+        if pool["count"] < n:
+            model, lock, _ = load_whisper(size, quantized)
+            with lock:
+                for _ in range(n - pool["count"]):
+                    pool["queue"].put(copy.deepcopy(model))
+            pool["count"] = n
+    return pool["queue"]
+
+
+def release_whisper_replicas(size: str, quantized: bool = False):
+    """Cuando termina la última transcripción en curso se liberan las copias: no quedan en memoria."""
+    pool = _replica_pool(size, quantized)
+    with pool["lock"]:
+        pool["active"] -= 1
+        if pool["active"] > 0:
+            return
+        # Sin transcripciones activas todas las copias han vuelto a la cola
+        while True:
+            try:
+                pool["queue"].get_nowait()
+            except queue.Empty:
+                break
+        pool["count"] = 0
+
+
+def detect_speech_segments(y, sr: int = SAMPLE_RATE, top_db: float = VAD_TOP_DB, max_seconds: float = SEGMENT_SECONDS):
+    """
+    Segmenta la señal por silencios (VAD por energía con librosa) y agrupa los tramos de voz
+    en segmentos de como máximo max_seconds (la ventana de Whisper). Devuelve [(inicio, fin)] en muestras.
+    """
+    max_len = int(max_seconds * sr)
+    segments = []
+    cur = None
+    for start, end in librosa.effects.split(y, top_db=top_db):
+        # Tramos de voz más largos que la ventana se parten en trozos fijos
+        pieces = [(s, min(s + max_len, end)) for s in range(int(start), int(end), max_len)]
+        for s, e in pieces:
+            if cur is not None and e - cur[0] <= max_len:
+                cur[1] = e
+            else:
+                if cur is not None:
+                    segments.append(tuple(cur))
+                cur = [s, e]
+    if cur is not None:
+        segments.append(tuple(cur))
+    return segments
+
+
+def _transcribe_segment(pool: queue.Queue, audio, options: dict) -> str:
+    model = pool.get()
+    try:
+        result = model.transcribe(audio, **options)
+    finally:
+        pool.put(model)
+    return result["text"].strip()
+
+
+def transcribe_long(size: str, y, segments, workers: int, quantized: bool = False, **options):
+    """
+    Transcribe los segmentos [(inicio, fin)] de y en un pool acotado de hilos.
+    Genera (índice, (inicio, fin), texto) a medida que terminan, no en orden.
+    En CPU cada hilo usa cpu // workers hilos intra-op de torch, para no sobresuscribir los núcleos.
+    """
+    on_cuda = load_whisper(size, quantized)[0].device.type == "cuda"
+    options.setdefault("fp16", on_cuda)
+    prev_threads = torch.get_num_threads()
+    per_worker = prev_threads if on_cuda else max(1, (os.cpu_count() or 1) // workers)
+    try:
+        pool = acquire_whisper_replicas(size, workers, quantized)
+        with ThreadPoolExecutor(max_workers=workers, initializer=torch.set_num_threads,
+                                initargs=(per_worker,)) as ex:
+            futures = {
+                ex.submit(_transcribe_segment, pool, y[s:e], options): (i, (s, e))
+                for i, (s, e) in enumerate(segments)
+            }
+            for fut in as_completed(futures):
+                i, seg = futures[fut]
+                yield i, seg, fut.result()
+    finally:
+        torch.set_num_threads(prev_threads)
+        release_whisper_replicas(size, quantized)
+
+
+def _fmt_ts(seconds: float) -> str:
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+def _stitch(done: dict, total: int, sr: int = SAMPLE_RATE) -> str:
+    """Une en orden los segmentos consecutivos ya terminados, con marcas de tiempo."""
+    lines = []
+    for i in range(total):
+        if i not in done:
+            break
+        (s, e), text = done[i]
+        if text:
+            lines.append(f"[{_fmt_ts(s / sr)} - {_fmt_ts(e / sr)}] {text}")
+    return "\n".join(lines)
+
+
+def _render_long(model_size: str, y: np.ndarray, workers: int, quantized: bool = False):
+    """Transcripción por segmentos mostrando el texto parcial a medida que avanza."""
+    try:
+        with st.spinner("Segmentando audio..."):
+            segments = detect_speech_segments(y)
+            total = len(segments)
+        if total == 0:
+            return None
+
+        progress = st.progress(0.0, text=f"0/{total} segmentos")
+        partial = st.empty()
+        done = {}
+        t0 = time.time()
+        for i, seg, text in transcribe_long(model_size, y, segments, workers, quantized):
+            done[i] = (seg, text)
+            progress.progress(len(done) / total, text=f"{len(done)}/{total} segmentos")
+            partial.text(_stitch(done, total))
+        elapsed = time.time() - t0
+    except Exception as e:
+        st.error(f"Error en la transcripción: {e}")
+        return None
+
+    text = _stitch(done, total)
+    if not text:
+        return None
+    st.success("Transcripción completada.")
+    partial.empty()
+    st.text_area("Texto reconocido", text, height=300)
+    duration = len(y) / SAMPLE_RATE
+    st.caption(
+        f"Modelo '{model_size}'{' int8' if quantized else ''} · {total} segmentos · {workers} hilos. "
+        f"Audio: {duration:.1f}s · Procesado en {elapsed:.1f}s (x{duration / max(elapsed, 1e-6):.1f} tiempo real)."
+    )
+    return text
+
+
+
+# ---------------------------
+# Comparación velocidad / precisión
+# ---------------------------
+def _words(text: str):
+    return re.sub(r"[^\w\s]", " ", text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """WER = distancia de edición por palabras / nº de palabras de la referencia."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1] / len(ref)
+
+
+def compare_backends(y: np.ndarray, sizes, reference: str = ""):
+    """
+    Transcribe y con cada tamaño en float32 e int8 y mide carga, inferencia, factor de tiempo real
+    (inferencia / duración) y WER. Sin referencia, el WER se mide contra float32 del mismo tamaño.
+    """
+    duration = len(y) / SAMPLE_RATE
+    rows = []
+    for size in sizes:
+        ref = reference
+        for quantized in (False, True):
+            result, load_time, infer_time = transcribe(size, y, quantized)
+            text = result["text"].strip()
+            if not reference and not quantized:
+                ref = text
+            rows.append({
+                "modelo": size,
+                "precisión": "int8" if quantized else "float32",
+                "carga_s": round(load_time, 2),
+                "inferencia_s": round(infer_time, 2),
+                "RTF": round(infer_time / max(duration, 1e-6), 3),
+                "WER": round(word_error_rate(ref, text), 3),
+            })
+    return pd.DataFrame(rows)
+
+
+def _render_comparison(uploaded):
+    with st.expander("Comparar float32 vs int8 (RTF y WER)", expanded=False):
+        sizes = st.multiselect("Modelos a comparar", WHISPER_SIZES, default=["base", "small"])
+        seconds = st.slider("Duración de la muestra (s)", 5, 60, 30, 5)
+        reference = st.text_area(
+            "Transcripción de referencia (opcional)",
+            help="Si se deja vacía, el WER de int8 se calcula respecto a float32 del mismo tamaño."
+        )
+        if not st.button("Ejecutar comparación") or not sizes:
+            return
+        with st.spinner("Comparando variantes..."):
+            try:
+                y = session_audio(uploaded, make_key(uploaded.getvalue()))[: seconds * SAMPLE_RATE]
+                df = compare_backends(y, sizes, reference.strip())
+            except Exception as e:
+                st.error(f"Error en la comparación: {e}")
+                return
+        st.dataframe(df, use_container_width=True)
+        st.caption("RTF < 1 significa más rápido que tiempo real. 'carga_s' ≈ 0 indica que el modelo ya estaba en memoria.")
+
+
+
+# ---------------------------
+# Transcripción en vivo
+# ---------------------------
+def _norm_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+class StreamingTranscriber:
+    """
+    Transcripción incremental sobre una ventana deslizante con acuerdo local: en cada paso se decodifica
+    la cola de audio aún no confirmada con marcas de tiempo por palabra, y solo se confirma el prefijo de
+    palabras en que coinciden las dos últimas hipótesis. El audio de esas palabras sale del búfer (la
+    ventana se mantiene corta) y el texto confirmado se pasa como contexto (initial_prompt). Si la
+    ventana llega a max_window sin acuerdo, se confirma todo salvo la última palabra, que sigue abierta.
+    """
+
+    def __init__(self, size: str, quantized: bool = False, step_seconds: float = 1.0,
+                 max_window: float = 6.0, prompt_chars: int = 200):
+        self.size = size
+        self.quantized = quantized
+        self.step = int(step_seconds * SAMPLE_RATE)
+        self.max_window = int(max_window * SAMPLE_RATE)
+        self.prompt_chars = prompt_chars
+        self.committed = []
+        self.hypothesis = []  # [(palabra, fin en s relativo al búfer)] aún sin confirmar
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.last_latency = 0.0
+        self._pending = 0
+
+    @property
+    def tentative(self) -> str:
+        return "".join(w for w, _ in self.hypothesis).strip()
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.committed + [self.tentative]).strip()
+
+    def push(self, audio: np.ndarray) -> bool:
+        """Añade audio a 16 kHz; decodifica cuando se acumula al menos un paso. Devuelve si hubo decodificación."""
+        self.buffer = np.concatenate([self.buffer, audio.astype(np.float32, copy=False)])
+        self._pending += len(audio)
+        if self._pending < self.step:
+            return False
+        self._pending = 0
+        self._decode()
+        return True
+
+    def flush(self) -> None:
+        """Decodifica y confirma lo que quede en el búfer (al detener el micrófono)."""
+        if len(self.buffer):
+            self._decode(final=True)
+
+    def _commit(self, words) -> None:
+        """Confirma `words` y recorta el búfer hasta el final de la última."""
+        text = "".join(w for w, _ in words).strip()
+        if text:
+            self.committed.append(text)
+        cut = min(int(words[-1][1] * SAMPLE_RATE), len(self.buffer))
+        self.buffer = self.buffer[cut:]
+
+    def _decode(self, final: bool = False) -> None:
+        prompt = " ".join(self.committed)[-self.prompt_chars:] or None
+        result, _, infer_time = transcribe(
+            self.size, self.buffer, self.quantized,
+            initial_prompt=prompt, condition_on_previous_text=False, word_timestamps=True
+        )
+        self.last_latency = infer_time
+        words = [(w["word"], w["end"]) for seg in result.get("segments", []) for w in seg.get("words", [])
+                 if w["word"].strip()]
+
+        if final:
+            self.hypothesis = []
+            if words:
+                self.committed.append("".join(w for w, _ in words).strip())
+            self.buffer = self.buffer[:0]
+            return
+
+        # Prefijo estable: palabras iguales en la hipótesis anterior y en la actual
+        stable = 0
+        for (prev, _), (cur, _) in zip(self.hypothesis, words):
+            if _norm_word(prev) != _norm_word(cur):
+                break
+            stable += 1
+        if not stable and len(self.buffer) >= self.max_window and len(words) > 1:
+            stable = len(words) - 1
+        if stable:
+            self._commit(words[:stable])
+            # Las marcas restantes pasan a ser relativas al nuevo inicio del búfer
+            offset = words[stable - 1][1]
+            words = [(w, end - offset) for w, end in words[stable:]]
+        self.hypothesis = words
+
+
+def frames_to_mono16k(frames) -> np.ndarray:
+    """Convierte tramas av.AudioFrame de WebRTC a mono float32 a 16 kHz."""
+    chunks = []
+    sr = SAMPLE_RATE
+    for frame in frames:
+        arr = frame.to_ndarray()
+        if np.issubdtype(arr.dtype, np.integer):
+            arr = arr.astype(np.float32) / np.iinfo(arr.dtype).max
+        channels = len(frame.layout.channels)
+        if frame.format.is_planar:
+            mono = arr.mean(axis=0)
+        else:
+            mono = arr.reshape(-1, channels).mean(axis=1)
+        chunks.append(mono.astype(np.float32))
+        sr = frame.sample_rate
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    y = np.concatenate(chunks)
+    if sr != SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=SAMPLE_RATE)
+    return y
+
+
+def _render_live(model_size: str, quantized: bool):
+    st.markdown("Habla al micrófono: el texto se actualiza en vivo. Para CPU se recomiendan 'tiny' o 'base'.")
+    if not WEBRTC_OK:
+        st.info("streamlit-webrtc no disponible en el entorno. Omitido.")
+        return
+
+    ctx = webrtc_streamer(
+        key="voz-en-vivo",
+        mode=WebRtcMode.SENDONLY,
+        audio_receiver_size=1024,
+        media_stream_constraints={"video": False, "audio": True},
+    )
+    transcript = st.empty()
+    status = st.empty()
+
+    streamer = st.session_state.get("voz_live")
+    if not ctx.state.playing:
+        if streamer is not None and streamer.text:
+            transcript.text(streamer.text)
+            st.download_button("Descargar TXT", data=streamer.text, file_name="transcripcion.txt", mime="text/plain")
+            st.button("Borrar transcripción", on_click=st.session_state.pop, args=("voz_live", None))
+        return
+
+    # Cualquier cambio de widget relanza el script: se sigue con el mismo transcriptor y su texto
+    if streamer is None:
+        streamer = StreamingTranscriber(model_size, quantized)
+        st.session_state["voz_live"] = streamer
+    streamer.size, streamer.quantized = model_size, quantized
+    transcript.text(streamer.text)
+    while ctx.state.playing:
+        if ctx.audio_receiver is None:
+            time.sleep(0.1)
+            continue
+        try:
+            frames = ctx.audio_receiver.get_frames(timeout=1)
+        except queue.Empty:
+            continue
+        # get_frames devuelve todo lo acumulado: si la decodificación se retrasa, el siguiente paso es mayor
+        if streamer.push(frames_to_mono16k(frames)):
+            transcript.text(streamer.text)
+            status.caption(
+                f"Decodificación: {streamer.last_latency:.2f}s · "
+                f"Ventana pendiente: {len(streamer.buffer) / SAMPLE_RATE:.1f}s"
+            )
+    streamer.flush()
+    transcript.text(streamer.text)
+
 
 def render():
     st.title("Voz → Texto (Whisper)")
 
     st.markdown("Sube un archivo WAV, MP3 u otro formato compatible y obtén la transcripción usando Whisper.")
 
+    model_size = st.selectbox(
+        "Tamaño del modelo",
+        WHISPER_SIZES,
+        index=WHISPER_SIZES.index("small"),
+        help="'tiny' es el más rápido, 'medium' el más preciso. Cada tamaño se carga una vez y se comparte entre sesiones."
+    )
+
+    precision = st.radio(
+        "Inferencia",
+        ["float32", "int8 (CPU, cuantizado)"],
+        horizontal=True,
+        help="int8 cuantiza dinámicamente las capas lineales: más rápido en CPU con una pequeña pérdida de precisión."
+    )
+    quantized = precision.startswith("int8")
+
+    source = st.radio("Entrada", ["Archivo", "Micrófono (en vivo)"], horizontal=True)
+    if source.startswith("Micrófono"):
+        _render_live(model_size, quantized)
+        return
+
+    long_mode = st.checkbox(
+        "Modo audio largo (segmentar por silencios y transcribir en paralelo)",
+        value=False,
+        help="Recomendado para grabaciones largas: muestra el texto a medida que se transcriben los segmentos."
+    )
+    if long_mode:
+        cpu = os.cpu_count() or 1
+        workers = st.slider(
+            "Hilos de transcripción", 1, max(1, min(cpu, 8)), min(cpu, 4),
+            help="Cada hilo usa su propia copia del modelo en memoria."
+        )
+
     # Subir archivo de audio
     uploaded = st.file_uploader("Subir archivo de audio", type=["wav", "mp3", "m4a", "ogg", "flac"])
 
     if uploaded is not None:
-        # Guardar temporalmente el archivo
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(uploaded.name).suffix) as tmp_file:
-            tmp_file.write(uploaded.read())
-            tmp_path = tmp_file.name
-
-        st.audio(tmp_path)  # Reproducir audio subido
+        st.audio(uploaded.getvalue(), format=uploaded.type or "audio/wav")  # Reproducir audio subido
 
         if st.button("Procesar audio"):
-            with st.spinner("Transcribiendo con Whisper..."):
+            audio_digest = make_key(uploaded.getvalue())
+            cache = _transcript_cache()
+            key = transcript_key(audio_digest, model_size, long_mode, precision="int8" if quantized else "float32")
+            cached = cache.get(key)
+            if cached is None:
                 try:
-                    model = whisper.load_model("small")  # Puedes cambiar a "base", "medium" o "large"
-                    result = model.transcribe(tmp_path)
-                    text = result["text"].strip()
+                    y = session_audio(uploaded, audio_digest)
                 except Exception as e:
-                    st.error(f"Error en la transcripción: {e}")
-                    text = None
+                    st.error(f"No se pudo decodificar el audio: {e}")
+                    return
+
+            if cached is not None:
+                text = cached.decode("utf-8")
+                st.success("Transcripción recuperada de la caché.")
+                st.text_area("Texto reconocido", text, height=300 if long_mode else 200)
+            elif long_mode:
+                text = _render_long(model_size, y, workers, quantized)
+            else:
+                with st.spinner("Transcribiendo con Whisper..."):
+                    try:
+                        result, load_time, infer_time = transcribe(model_size, y, quantized)
+                        text = result["text"].strip()
+                    except Exception as e:
+                        st.error(f"Error en la transcripción: {e}")
+                        text = None
+
+                if text:
+                    st.success("Transcripción completada.")
+                    st.text_area("Texto reconocido", text, height=200)
+                    st.caption(f"Modelo '{model_size}'{' int8' if quantized else ''}. Carga: {load_time:.2f}s · Inferencia: {infer_time:.2f}s.")
 
             if text:
-                st.success("Transcripción completada.")
-                st.text_area("Texto reconocido", text, height=200)
+                if cached is None:
+                    cache.set(key, text.encode("utf-8"))
                 st.download_button("Descargar TXT", data=text, file_name="transcripcion.txt", mime="text/plain")
             else:
                 st.warning("No se pudo transcribir el audio.")
+            st.caption(f"Caché de transcripciones: {cache.stats_text()}.")
 
-        # Eliminar archivo temporal
-        os.remove(tmp_path)
+        _render_comparison(uploaded)